@@ -0,0 +1,86 @@
+# Setup shared by the benchmark scripts. configure() has to run before the app is
+# imported, its modules read the database URL and storage paths on import.
+
+from contextlib import asynccontextmanager
+
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scratch databases and image directories live here, outside the source tree
+BENCH_DIR = os.getenv("BENCH_DIR", os.path.join(tempfile.gettempdir(), "social-bench"))
+
+
+def path(name: str):
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    return os.path.join(BENCH_DIR, name)
+
+
+def database_url(name: str):
+    return f"sqlite:///{path(name)}.db"
+
+
+def same_database(a: str, b: str):
+    a, b = make_url(a), make_url(b)
+    return ((a.get_backend_name(), a.host, a.port, a.database)
+            == (b.get_backend_name(), b.host, b.port, b.database))
+
+
+def configure(name: str, **environ):
+    # The scripts seed and write to their database, so it is never the app's own:
+    # URL_DATABASE is replaced by BENCH_URL_DATABASE or a SQLite file of the script's
+    # own, and it has to be named as a benchmark database
+    if multiprocessing.current_process().name != "MainProcess":
+        # A worker re-importing the script, the environment is already its parent's
+        return
+
+    load_dotenv()
+    app_database = os.getenv("URL_DATABASE")
+    bench_database = os.getenv("BENCH_URL_DATABASE") or database_url(name)
+
+    if app_database and same_database(bench_database, app_database):
+        sys.exit("BENCH_URL_DATABASE is the app's URL_DATABASE, point it at a scratch database")
+
+    if "bench" not in os.path.basename(make_url(bench_database).database or ""):
+        sys.exit(f"{bench_database} is not a scratch database, its name has to contain 'bench'")
+
+    os.environ["URL_DATABASE"] = bench_database
+    os.environ["IMAGE_STORAGE_PATH"] = path(f"{name}_images")
+    # Derived from URL_DATABASE by database.py
+    os.environ.pop("ASYNC_URL_DATABASE", None)
+
+    # Defaults for the other settings, plus whatever else the script passes
+    defaults = {"SECRET_KEY": "bench", "ALGORITHM": "HS256", **environ}
+
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def create_schema():
+    # Built by the migrations like the app's own database, without alembic.ini so
+    # its logging config does not replace the app's
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    command.upgrade(config, "head")
+
+
+@asynccontextmanager
+async def app_client(**options):
+    # Drives the app in-process, started and shut down around the client
+    import httpx
+    import main
+
+    async with main.lifespan(main.app), httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://bench",
+            **options) as client:
+        yield client
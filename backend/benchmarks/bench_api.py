@@ -0,0 +1,295 @@
+# Load test of the main API paths. Seeds a database with users, posts, comments and
+# likes, drives the app in-process with a pool of concurrent clients and reports
+# throughput and p50/p95/p99 latency per scenario. Results are written as JSON so
+# runs on different commits can be compared.
+#
+#   cd backend && python -m benchmarks.bench_api --users 1000 --posts 20000 --output before.json
+#   cd backend && python -m benchmarks.bench_api --output after.json --compare before.json
+#
+# The database and images go to a scratch directory, see benchmarks/_common.py. Point
+# BENCH_URL_DATABASE at a MySQL database named e.g. social_bench to benchmark that
+# instead of SQLite, the app's own URL_DATABASE is refused.
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from benchmarks import _common
+
+# Requests queue on a single SQLite connection under load
+_common.configure("bench_api", DB_POOL_TIMEOUT="600")
+
+import httpx
+from PIL import Image
+from sqlalchemy import func, insert
+
+import counters
+import passwords
+from database import engine, sessionLocal
+from models import User, Post, PostComment, PostLike
+from routers import auth
+
+PASSWORD = "bench"
+WORDS = ["python", "fastapi", "travel", "coffee", "music", "garden", "football", "movie",
+         "recipe", "mountain", "sunset", "startup", "design", "history", "science"]
+BATCH = 10000
+
+SCENARIOS = ["register", "login", "list_posts", "get_post", "search", "like", "unlike",
+             "comment", "upload_image"]
+
+
+def batches(rows):
+    for i in range(0, len(rows), BATCH):
+        yield rows[i:i + BATCH]
+
+
+def seed(args):
+    _common.create_schema()
+    db = sessionLocal()
+
+    try:
+        if db.query(func.count(User.id)).scalar() >= args.users:
+            return
+
+        random.seed(args.seed)
+        # One hash shared by every seeded user keeps seeding fast, logins still verify it
+        hashed_password = passwords.bcrypt_context.hash(PASSWORD)
+
+        for rows in batches([{"username": f"bench{i}", "first_name": "b", "last_name": "b",
+                              "hashed_password": hashed_password} for i in range(args.users)]):
+            db.execute(insert(User), rows)
+
+        for rows in batches([{"owner_id": random.randint(1, args.users),
+                              "content": " ".join(random.sample(WORDS, 4))}
+                             for _ in range(args.posts)]):
+            db.execute(insert(Post), rows)
+
+        for rows in batches([{"post": random.randint(1, args.posts), "owner": random.randint(1, args.users),
+                              "content": " ".join(random.sample(WORDS, 3))}
+                             for _ in range(args.comments)]):
+            db.execute(insert(PostComment), rows)
+
+        likes = {(random.randint(1, args.users), random.randint(1, args.posts))
+                 for _ in range(args.likes)}
+        for rows in batches([{"owner": owner, "post": post} for owner, post in sorted(likes)]):
+            db.execute(insert(PostLike), rows)
+
+        db.commit()
+
+        counters.reconcile_comment_counts(db)
+        counters.reconcile_like_counts(db)
+        counters.rescore_hot_posts(db)
+    finally:
+        db.close()
+
+
+def fixtures(args):
+    # Deterministic inputs for the write scenarios, read back from the seeded database
+    db = sessionLocal()
+
+    try:
+        users = db.query(User.id, User.username).order_by(User.id).limit(args.users).all()
+        posts = db.query(Post.id, Post.owner_id).order_by(Post.id).limit(args.posts).all()
+        liked = set(db.query(PostLike.owner, PostLike.post).all())
+    finally:
+        db.close()
+
+    rng = random.Random(args.seed)
+    tokens = {user.id: auth.create_access_token(user.username, user.id) for user in users}
+
+    # Pairs not liked yet, liked by the like scenario and removed again by unlike
+    pairs = set()
+    while len(pairs) < args.requests and len(pairs) < len(users) * len(posts) - len(liked):
+        pair = (rng.choice(users).id, rng.choice(posts).id)
+        if pair not in liked:
+            pairs.add(pair)
+
+    return {"users": users, "posts": posts, "tokens": tokens, "pairs": sorted(pairs), "rng": rng}
+
+
+def png(rng: random.Random):
+    # Random pixels, so every upload is a new blob and not a deduplicated one
+    image = Image.frombytes("RGB", (64, 64), rng.randbytes(64 * 64 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def requests_for(name: str, args, data, run_id: str):
+    # Returns one (method, url, options) per request of the scenario
+    rng, users, posts, tokens = data["rng"], data["users"], data["posts"], data["tokens"]
+
+    def headers(user_id):
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    def reader():
+        return headers(rng.choice(users).id)
+
+    for i in range(args.requests):
+        if name == "register":
+            yield "POST", "/auth/register", {"json": {
+                "username": f"load{run_id}_{i}", "password": PASSWORD,
+                "first_name": "b", "last_name": "b"}}
+        elif name == "login":
+            yield "POST", "/auth/token", {"data": {"username": rng.choice(users).username,
+                                                   "password": PASSWORD}}
+        elif name == "list_posts":
+            yield "GET", "/posts/", {"params": {"limit": 20, "cursor": ""}, "headers": reader()}
+        elif name == "get_post":
+            yield "GET", f"/posts/{rng.choice(posts).id}", {"headers": reader()}
+        elif name == "search":
+            yield "GET", "/posts/", {"params": {"search": rng.choice(WORDS), "limit": 20},
+                                     "headers": reader()}
+        elif name in ("like", "unlike"):
+            if i >= len(data["pairs"]):
+                return
+            owner, post = data["pairs"][i]
+            yield "POST" if name == "like" else "DELETE", f"/posts/{post}/like", {"headers": headers(owner)}
+        elif name == "comment":
+            yield "POST", f"/comments/{rng.choice(posts).id}", {
+                "json": {"content": " ".join(rng.sample(WORDS, 3))}, "headers": reader()}
+        elif name == "upload_image":
+            post = rng.choice(posts)
+            yield "POST", f"/posts/{post.id}/upload-image", {
+                "files": {"image": (f"bench{i}.png", png(rng), "image/png")},
+                "headers": headers(post.owner_id)}
+
+
+def percentile(latencies: list, p: float):
+    # Nearest rank on sorted latencies
+    return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+
+
+async def run_scenario(client: httpx.AsyncClient, requests: list, concurrency: int):
+    queue = list(reversed(requests))
+    latencies, statuses = [], Counter()
+
+    async def worker():
+        while queue:
+            method, url, options = queue.pop()
+            started = time.perf_counter()
+            response = await client.request(method, url, **options)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for code, count in statuses.items() if code >= 400)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 3) if latencies else None,
+    }
+
+
+async def run(args):
+    seed(args)
+    data = fixtures(args)
+    run_id = f"{int(time.time())}"
+    results = {}
+
+    async with _common.app_client(timeout=None) as client:
+        for name in args.scenarios:
+            # Build the requests up front so generating them (e.g. PNGs) is not timed
+            requests = list(requests_for(name, args, data, run_id))
+            # Writes that can only succeed once are not warmed up
+            warmup = [] if name in ("register", "like", "unlike") else requests[:args.warmup]
+
+            if warmup:
+                await run_scenario(client, warmup, args.concurrency)
+
+            results[name] = await run_scenario(client, requests, args.concurrency)
+            report(name, results[name])
+
+    return results
+
+
+def report(name: str, result: dict):
+    if not result["requests"]:
+        print(f"{name:>14}: no requests")
+        return
+
+    print(f"{name:>14}: {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+          f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+          f"errors {result['errors']}/{result['requests']}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\nchange against {baseline_path} ({baseline.get('commit')}):")
+
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before or not before["requests"] or not result["requests"]:
+            continue
+
+        changes = [f"{key} {(result[key] - before[key]) / before[key] * 100:+7.1f}%"
+                   for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms") if before[key]]
+        print(f"{name:>14}: " + "  ".join(changes))
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--likes", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--output", default="bench_api.json")
+    parser.add_argument("--compare", help="earlier --output file to compare against")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = asyncio.run(run(args))
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "started_at": started_at,
+            "database": engine.dialect.name,
+            "python": platform.python_version(),
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "compare")},
+            "results": results,
+        }, f, indent=2)
+
+    print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,134 @@
+# GET /feed latency for a reader following 200 regular and 5 big authors, at growing
+# table sizes. Regular authors are fanned out to timeline_entries, big ones are
+# merged in on read. Each size gets its own SQLite file, seeded once.
+#
+#   cd backend && python -m benchmarks.bench_feed --sizes 1000 100000 1000000
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import _common
+
+from sqlalchemy import func, insert
+
+AUTHORS = 1000
+FOLLOWED = 200
+BIG_AUTHORS = 5
+READER = 1
+BATCH = 50000
+
+
+def seed(count: int, threshold: int):
+    from database import sessionLocal
+    from models import User, Post, Follow, TimelineEntry
+
+    _common.create_schema()
+
+    with sessionLocal() as db:
+        if db.query(func.count(Post.id)).scalar() >= count:
+            return
+
+        # Reader, regular authors, then big authors
+        db.execute(insert(User), [{"username": f"user{i}", "first_name": "b", "last_name": "b",
+                                   "hashed_password": "", "followers_count": 0}
+                                  for i in range(1 + AUTHORS)] +
+                   [{"username": f"big{i}", "first_name": "b", "last_name": "b",
+                     "hashed_password": "", "followers_count": threshold}
+                    for i in range(BIG_AUTHORS)])
+
+        random.seed(0)
+        regular = random.sample(range(2, AUTHORS + 2), FOLLOWED)
+        big = list(range(AUTHORS + 2, AUTHORS + 2 + BIG_AUTHORS))
+        db.execute(insert(Follow), [{"follower": READER, "followee": author}
+                                    for author in regular + big])
+
+        followed = set(regular)
+        start = datetime(2024, 1, 1)
+
+        for offset in range(0, count, BATCH):
+            posts, entries = [], []
+
+            for id in range(offset + 1, min(offset + BATCH, count) + 1):
+                owner = random.randint(2, AUTHORS + 1 + BIG_AUTHORS)
+                created_at = start + timedelta(seconds=id)
+                posts.append({"id": id, "owner_id": owner, "content": f"post {id}",
+                              "created_at": created_at})
+
+                if owner in followed:
+                    entries.append({"owner": READER, "post": id, "created_at": created_at})
+
+            db.execute(insert(Post), posts)
+            if entries:
+                db.execute(insert(TimelineEntry), entries)
+
+        db.commit()
+
+
+async def measure(args):
+    from routers import auth
+
+    headers = {"Authorization": f"Bearer {auth.create_access_token('user0', READER)}"}
+    results = {}
+
+    async with _common.app_client() as client:
+        cursor, page = "", 0
+
+        while page < args.pages and cursor is not None:
+            latencies = []
+
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = await client.get("/feed", params={"limit": args.limit, "cursor": cursor},
+                                            headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+            page += 1
+            if page in (1, args.pages):
+                results[page] = sorted(latencies)[len(latencies) // 2] * 1000
+
+            cursor = response.json()["next_cursor"]
+
+    return results
+
+
+def run(size: int, args):
+    # The app binds its engines at import time, so every size runs in a fresh process
+    os.environ["FEED_FANOUT_THRESHOLD"] = str(args.threshold)
+    _common.configure(f"bench_feed_{size}", CACHE_BACKEND="none")
+
+    seed(size, args.threshold)
+
+    for page, latency in asyncio.run(measure(args)).items():
+        print(f"{size:>8} posts, page {page:>3}: {latency:8.3f} ms (median of {args.repeat})")
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threshold", type=int, default=10000)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        run(args.size, args)
+        return
+
+    for size in args.sizes:
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_feed", "--size", str(size),
+                        "--limit", str(args.limit), "--pages", str(args.pages),
+                        "--repeat", str(args.repeat), "--threshold", str(args.threshold)],
+                       check=True)
+
+
+if __name__ == "__main__":
+    main_()
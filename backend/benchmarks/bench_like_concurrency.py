@@ -0,0 +1,80 @@
+# Times concurrent likes (each user twice) at one post. tests/test_likes.py checks the
+# counter stays exact.
+#
+#   cd backend && python -m benchmarks.bench_like_concurrency --users 1000
+
+import argparse
+import asyncio
+import time
+
+from benchmarks import _common
+
+# Every request queues on a single SQLite connection, allow for the whole burst
+_common.configure("bench_like_concurrency", DB_POOL_TIMEOUT="600")
+
+from sqlalchemy import delete, func, insert, update
+
+from database import sessionLocal
+from models import User, Post, PostLike
+from routers import auth
+
+
+def seed(count: int):
+    _common.create_schema()
+    db = sessionLocal()
+
+    existing = db.query(func.count(User.id)).scalar()
+    db.execute(insert(User), [{"username": f"bench{i}", "first_name": "b", "last_name": "b",
+                               "hashed_password": ""} for i in range(existing, count)])
+
+    post = db.query(Post).first()
+    if post is None:
+        post = Post(owner_id=1, content="viral")
+        db.add(post)
+        db.flush()
+
+    post_id = post.id
+    db.execute(delete(PostLike).filter(PostLike.post == post_id))
+    db.execute(update(Post).filter(Post.id == post_id).values(likes=0))
+    db.commit()
+
+    users = db.query(User.id, User.username).order_by(User.id).limit(count).all()
+    db.close()
+
+    return post_id, [auth.create_access_token(user.username, user.id) for user in users]
+
+
+async def run(args):
+    post_id, tokens = seed(args.users)
+    limits = asyncio.Semaphore(args.concurrency)
+
+    async with _common.app_client() as client:
+        async def like(token):
+            async with limits:
+                response = await client.post(f"/posts/{post_id}/like",
+                                             headers={"Authorization": f"Bearer {token}"})
+                return response.status_code
+
+        started = time.perf_counter()
+        codes = await asyncio.gather(*[like(token) for token in tokens * 2])
+        elapsed = time.perf_counter() - started
+
+    db = sessionLocal()
+    likes = db.query(Post.likes).filter(Post.id == post_id).scalar()
+    rows = db.query(func.count(PostLike.id)).filter(PostLike.post == post_id).scalar()
+    db.close()
+
+    print(f"{len(codes)} requests in {elapsed:.2f} s: {codes.count(201)} created, "
+          f"{codes.count(403)} duplicates, {len(codes) - codes.count(201) - codes.count(403)} other")
+    print(f"counter {likes}, like rows {rows}, expected {len(tokens)}")
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
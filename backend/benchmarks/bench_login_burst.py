@@ -0,0 +1,63 @@
+# Measures GET /posts/ latency on its own and while a burst of logins is hashing
+# passwords, driving the app in-process on a single event loop.
+#
+#   cd backend && python -m benchmarks.bench_login_burst --logins 50
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import _common
+
+_common.configure("bench_login_burst")
+
+
+async def sample_posts(client, headers, count: int):
+    latencies = []
+
+    for _ in range(count):
+        started = time.perf_counter()
+        response = await client.get("/posts/", headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(0.005)
+
+    return latencies
+
+
+def report(name: str, latencies: list):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>16}: p50 {statistics.median(latencies):8.2f} ms  p99 {p99:8.2f} ms")
+
+
+async def run(args):
+    _common.create_schema()
+
+    async with _common.app_client() as client:
+        user = {"username": "bench", "password": "bench", "first_name": "b", "last_name": "b"}
+        await client.post("/auth/register", json=user)
+        login = {"username": "bench", "password": "bench"}
+        token = (await client.post("/auth/token", data=login)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for i in range(20):
+            await client.post("/posts/", json={"content": f"post {i}"}, headers=headers)
+
+        report("idle", await sample_posts(client, headers, args.samples))
+
+        burst = [client.post("/auth/token", data=login) for _ in range(args.logins)]
+        results = await asyncio.gather(sample_posts(client, headers, args.samples), *burst)
+        report("login burst", results[0])
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
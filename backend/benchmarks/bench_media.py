@@ -0,0 +1,107 @@
+# Image download throughput of the streaming media route against reading the whole
+# file into memory per request, served by uvicorn over loopback.
+#
+#   cd backend && python -m benchmarks.bench_media --size-mb 8 --requests 200 --concurrency 16
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+import tracemalloc
+
+from benchmarks import _common
+
+_common.configure("bench_media")
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Response
+
+import models
+from routers import media
+
+
+app = FastAPI()
+app.include_router(media.router)
+
+
+@app.get("/naive/{name}")
+async def naive(name: str):
+    with open(models.image_storage.get_path(name), "rb") as f:
+        return Response(content=f.read(), media_type="application/octet-stream")
+
+
+def seed(size_mb: int):
+    # Random bytes, only the suffix has to be one the media route serves
+    name = f"{'ab' * 20}.jpg"
+    models.image_storage.shard(name).mkdir(parents=True, exist_ok=True)
+
+    with open(models.image_storage.get_path(name), "wb") as f:
+        f.write(os.urandom(size_mb * 1024 * 1024))
+
+    return name
+
+
+async def download(client: httpx.AsyncClient, url: str):
+    received = 0
+
+    async with client.stream("GET", url) as response:
+        async for chunk in response.aiter_raw():
+            received += len(chunk)
+
+    return received
+
+
+async def measure(url: str, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(client):
+        async with semaphore:
+            return await download(client, url)
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        tracemalloc.start()
+        started = time.perf_counter()
+        received = sum(await asyncio.gather(*[one(client) for _ in range(args.requests)]))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return received, elapsed, peak
+
+
+async def run(args, base: str, name: str):
+    for label, url in (("read into memory", f"{base}/naive/{name}"),
+                       ("streaming route", f"{base}/static/images/{name}")):
+        received, elapsed, peak = await measure(url, args)
+        print(f"{label:>17}: {args.requests / elapsed:8.1f} req/s  "
+              f"{received / elapsed / 2 ** 20:8.1f} MiB/s  peak traced {peak / 2 ** 20:7.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    name = seed(args.size_mb)
+
+    server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        asyncio.run(run(args, f"http://127.0.0.1:{args.port}", name))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Compares OFFSET and keyset (cursor) pagination on a seeded SQLite database.
+#
+#   cd backend && python -m benchmarks.bench_pagination --posts 200000 --page 10000
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import _common
+
+_common.configure("bench_pagination")
+
+from sqlalchemy import insert
+
+import pagination
+from database import sessionLocal
+from models import User, Post
+
+
+def seed(db, count: int):
+    if db.query(Post).count() >= count:
+        return
+
+    db.execute(insert(User), [{"username": "bench", "first_name": "b", "last_name": "b",
+                               "hashed_password": ""}])
+    start = datetime(2024, 1, 1)
+    rows = [{"owner_id": 1, "content": f"post {i}", "created_at": start + timedelta(seconds=i)}
+            for i in range(count)]
+
+    for i in range(0, count, 10000):
+        db.execute(insert(Post), rows[i:i + 10000])
+    db.commit()
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=200000)
+    parser.add_argument("--page", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    _common.create_schema()
+    db = sessionLocal()
+    seed(db, args.posts)
+
+    ordered = db.query(Post).order_by(Post.created_at.desc(), Post.id.desc())
+    skip = (args.page - 1) * args.limit
+
+    # Cursor of the last row of the page before the one being measured
+    before = ordered.offset(skip - 1).first() if skip else None
+    deep_cursor = pagination.encode_cursor(before.created_at, before.id) if before else ""
+
+    results = {
+        "offset page 1": lambda: ordered.limit(args.limit).offset(0).all(),
+        f"offset page {args.page}": lambda: ordered.limit(args.limit).offset(skip).all(),
+        "cursor page 1": lambda: pagination.seek(db.query(Post), Post, "", args.limit).all(),
+        f"cursor page {args.page}": lambda: pagination.seek(db.query(Post), Post, deep_cursor,
+                                                             args.limit).all(),
+    }
+
+    for name, fn in results.items():
+        print(f"{name:>24}: {timed(fn, args.repeat):8.3f} ms")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
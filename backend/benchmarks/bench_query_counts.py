@@ -0,0 +1,78 @@
+# SQL statements per request for the post endpoints at growing page sizes. The
+# counts must not depend on the page size, owners are loaded in one batch per page.
+#
+#   cd backend && python -m benchmarks.bench_query_counts --posts 500
+
+import argparse
+import asyncio
+
+from benchmarks import _common
+
+_common.configure("bench_query_counts", CACHE_BACKEND="none", SEARCH_BACKEND="memory")
+
+from sqlalchemy import func, insert
+
+from database import count_queries, sessionLocal
+from models import User, Post
+from routers import auth
+
+
+def seed(count: int):
+    _common.create_schema()
+    db = sessionLocal()
+
+    if db.query(func.count(Post.id)).scalar() < count:
+        # A different owner per post, the worst case for per-row owner loading
+        db.execute(insert(User), [{"username": f"owner{i}", "first_name": "b", "last_name": "b",
+                                   "hashed_password": ""} for i in range(count)])
+        owners = [id for id, in db.query(User.id).order_by(User.id.desc()).limit(count)]
+        db.execute(insert(Post), [{"owner_id": owner, "content": f"bench post {i}"}
+                                  for i, owner in enumerate(owners)])
+        db.commit()
+
+    db.close()
+
+
+async def run(args):
+    token = auth.create_access_token("bench", 1)
+    headers = {"Authorization": f"Bearer {token}"}
+    endpoints = {
+        "list": lambda limit: ("/posts/", {"limit": limit}),
+        "cursor": lambda limit: ("/posts/", {"limit": limit, "cursor": ""}),
+        "search": lambda limit: ("/posts/", {"limit": limit, "search": "bench"}),
+        "detail": lambda limit: ("/posts/1", {}),
+    }
+
+    async with _common.app_client() as client:
+        for name, request in endpoints.items():
+            # Warm up lazily built state such as the in-memory search index
+            url, params = request(args.limits[0])
+            await client.get(url, params=params, headers=headers)
+
+            counts = []
+
+            for limit in args.limits:
+                url, params = request(limit)
+
+                with count_queries() as queries:
+                    response = await client.get(url, params=params, headers=headers)
+                    response.raise_for_status()
+
+                counts.append(queries.count)
+
+            print(f"{name:>8}: " + "  ".join(f"limit={limit}: {count}"
+                                             for limit, count in zip(args.limits, counts)))
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    seed(args.posts)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_()
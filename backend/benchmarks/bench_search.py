@@ -0,0 +1,89 @@
+# Compares LIKE '%...%' search with the search index on a seeded SQLite database.
+#
+#   cd backend && python -m benchmarks.bench_search --posts 200000
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import _common
+
+_common.configure("bench_search")
+
+from sqlalchemy import insert, select
+
+import search
+from database import asyncSessionLocal, async_engine, sessionLocal
+from models import User, Post
+
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india",
+         "juliet", "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo"]
+
+
+def seed(db, count: int):
+    if db.query(Post).count() >= count:
+        return
+
+    rng = random.Random(0)
+    db.execute(insert(User), [{"username": "bench", "first_name": "b", "last_name": "b",
+                               "hashed_password": ""}])
+    rows = [{"owner_id": 1, "content": " ".join(rng.choices(WORDS, k=12)) + f" tag{i}"}
+            for i in range(count)]
+
+    for i in range(0, count, 10000):
+        db.execute(insert(Post), rows[i:i + 10000])
+    db.commit()
+
+
+async def timed(fn, repeat: int):
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        best = min(best, time.perf_counter() - started)
+
+    return best * 1000
+
+
+async def run(args):
+    # The search module runs on the API's async sessions, time it through one
+    async with asyncSessionLocal() as db:
+        started = time.perf_counter()
+        await search._get_index(db, Post)
+        print(f"{'index build':>24}: {(time.perf_counter() - started) * 1000:8.1f} ms "
+              f"({search.SEARCH_BACKEND})")
+
+        for query in ["tag12345", "november"]:
+            async def like():
+                return (await db.execute(select(Post).filter(
+                    Post.content.contains(query)).limit(args.limit))).scalars().all()
+
+            async def ranked():
+                return await search.ranked_ids(db, Post, query, args.limit)
+
+            print(f"{'LIKE ' + query:>24}: {await timed(like, args.repeat):8.3f} ms")
+            print(f"{'index ' + query:>24}: {await timed(ranked, args.repeat):8.3f} ms")
+
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    _common.create_schema()
+    db = sessionLocal()
+    seed(db, args.posts)
+    db.close()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# Per-request authentication overhead of get_current_user with and without the
+# verified token cache.
+#
+#   cd backend && python -m benchmarks.bench_token_cache --requests 20000
+
+import argparse
+import asyncio
+import time
+
+from benchmarks import _common
+
+_common.configure("bench_token_cache")
+
+from routers import auth
+
+
+async def run(args):
+    tokens = [auth.create_access_token(f"bench{i}", i) for i in range(args.users)]
+
+    for enabled in (False, True):
+        auth.TOKEN_CACHE_ENABLED = enabled
+
+        started = time.perf_counter()
+        for i in range(args.requests):
+            await auth.get_current_user(tokens[i % len(tokens)])
+        elapsed = time.perf_counter() - started
+
+        print(f"{'cache on' if enabled else 'cache off':>10}: "
+              f"{elapsed / args.requests * 1e6:8.2f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Bulk creation helpers: multi-row INSERTs and NDJSON request bodies read in bounded
+# batches, one transaction per batch.
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from starlette import status
+
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Items per bulk request, and per transaction of an NDJSON import
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+# Longest NDJSON line accepted, bounds the memory of a streamed import
+BULK_MAX_LINE = int(os.getenv("BULK_MAX_LINE", str(64 * 1024)))
+
+
+def check_size(items: list):
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="At least one item is required")
+
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {BULK_MAX_ITEMS} items can be created at once, "
+                                   "use the NDJSON import for more")
+
+
+async def insert_many(db: AsyncSession, model, rows: list):
+    # One multi-row INSERT, returns the new ids in the order of `rows`. The rows of one
+    # INSERT ... VALUES get ascending ids: SQLite has a single writer and InnoDB reserves
+    # the whole id range up front for inserts with a known number of rows.
+    statement = insert(model).values(rows)
+
+    if db.bind.dialect.insert_returning:
+        return sorted((await db.execute(statement.returning(model.id))).scalars())
+
+    # MySQL has no RETURNING, lastrowid is the id of the first row and the others follow
+    # auto_increment_increment apart, a session setting read on the same connection
+    result = await db.execute(statement)
+    step = await db.scalar(text("SELECT @@auto_increment_increment"))
+    return list(range(result.lastrowid, result.lastrowid + step * len(rows), step))
+
+
+async def read_lines(request: Request):
+    # Yields (line number, line) of the body as it arrives, blank lines skipped
+    buffer = b""
+    number = 0
+
+    async for chunk in request.stream():
+        *lines, buffer = (buffer + chunk).split(b"\n")
+
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+
+        if len(buffer) > BULK_MAX_LINE:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail={"line": number + 1,
+                                        "error": f"Lines are limited to {BULK_MAX_LINE} bytes"})
+
+    if buffer.strip():
+        yield number + 1, buffer
+
+
+async def import_ndjson(request: Request, schema, insert_batch):
+    # Validates one `schema` item per line and hands them to `insert_batch` in batches
+    # of BULK_MAX_ITEMS, which commits each. Batches committed before a bad line or a
+    # failed batch stay, the error reports how many items were created.
+    created = 0
+    batch = []
+
+    try:
+        async for number, line in read_lines(request):
+            try:
+                batch.append(schema.model_validate_json(line))
+            except ValidationError as error:
+                errors = error.errors(include_url=False, include_context=False, include_input=False)
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail={"line": number, "errors": errors})
+
+            if len(batch) == BULK_MAX_ITEMS:
+                created += len(await insert_batch(batch))
+                batch = []
+
+        if batch:
+            created += len(await insert_batch(batch))
+    except HTTPException as error:
+        detail = error.detail if isinstance(error.detail, dict) else {"error": error.detail}
+        raise HTTPException(status_code=error.status_code, detail={**detail, "created": created})
+
+    return {"created": created}
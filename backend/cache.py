@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# "memory" is a per-worker LRU, "redis" talks the Redis protocol to CACHE_REDIS_URL
+# and is shared between workers, "none" disables caching
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def metrics(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class NullCache(CacheStats):
+    async def get(self, key: str):
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: bytes, ttl: float = CACHE_TTL):
+        pass
+
+    async def delete(self, *keys: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+class LRUCache(CacheStats):
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        # key -> (expires_at, value), least recently used first
+        self.entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float = CACHE_TTL):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def close(self):
+        self.entries.clear()
+
+
+class RedisCache(CacheStats):
+    # Minimal RESP client for GET/SET/DEL, enough for any Redis-compatible server.
+    # Evictions are done by the server and are not counted here.
+    def __init__(self, url: str = CACHE_REDIS_URL):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        if self.password:
+            await self._call("AUTH", self.password)
+        if self.db:
+            await self._call("SELECT", str(self.db))
+
+    async def _read(self):
+        line = await self.reader.readline()
+
+        if not line:
+            raise ConnectionError("Redis connection closed")
+
+        kind, body = line[:1], line[1:-2]
+
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"-":
+            raise RuntimeError(body.decode())
+        if kind == b":":
+            return int(body)
+
+        return body
+
+    async def _call(self, *args):
+        command = [f"*{len(args)}\r\n".encode()]
+
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+        self.writer.write(b"".join(command))
+        await self.writer.drain()
+
+        return await self._read()
+
+    async def call(self, *args):
+        async with self.lock:
+            try:
+                if self.writer is None:
+                    await self._connect()
+                return await self._call(*args)
+            except (ConnectionError, OSError, RuntimeError, asyncio.IncompleteReadError):
+                # Reconnect on the next call, a cache outage must not fail requests
+                await self.close()
+                return None
+            except BaseException:
+                # Cancelled with the reply still unread, the next command would read it
+                # as its own. The connection is dropped instead.
+                await self.close()
+                raise
+
+    async def get(self, key: str):
+        value = await self.call("GET", key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float = CACHE_TTL):
+        await self.call("SET", key, value, "PX", int(ttl * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.call("DEL", *keys)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def create_cache(backend: str = CACHE_BACKEND):
+    if backend == "redis":
+        return RedisCache()
+    if backend == "none":
+        return NullCache()
+
+    return LRUCache()
+
+
+cache = create_cache()
+
+
+def post_key(id: int):
+    return f"post:{id}"
+
+
+def comment_key(id: int):
+    return f"comment:{id}"
@@ -0,0 +1,97 @@
+from fastapi import HTTPException
+
+from starlette import status
+
+import asyncio
+import httpx
+import os
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+PRIVATE_KEY = os.getenv("PRIVATE_KEY")
+
+CHAT_ENGINE_URL = os.getenv("CHAT_ENGINE_URL", "https://api.chatengine.io/users/")
+CHAT_ENGINE_TIMEOUT = float(os.getenv("CHAT_ENGINE_TIMEOUT", "5"))
+CHAT_ENGINE_RETRIES = int(os.getenv("CHAT_ENGINE_RETRIES", "3"))
+CHAT_ENGINE_BACKOFF = float(os.getenv("CHAT_ENGINE_BACKOFF", "0.2"))
+# Seconds a provisioned username is remembered, 0 disables the cache
+CHAT_ENGINE_CACHE_TTL = float(os.getenv("CHAT_ENGINE_CACHE_TTL", "300"))
+CHAT_ENGINE_CACHE_SIZE = int(os.getenv("CHAT_ENGINE_CACHE_SIZE", "10000"))
+
+client = None
+
+# username -> (expires_at, upstream response)
+provisioned = {}
+
+
+def get_client():
+    global client
+
+    # One pooled client per worker so connections to the chat engine are kept alive
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=CHAT_ENGINE_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            headers={"Private-Key": PRIVATE_KEY or ""},
+        )
+
+    return client
+
+
+async def close():
+    global client
+
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def remember(username: str, body):
+    now = time.monotonic()
+
+    if len(provisioned) >= CHAT_ENGINE_CACHE_SIZE:
+        for name in [name for name, (expires, _) in provisioned.items() if expires <= now]:
+            del provisioned[name]
+
+    # Still full of live entries, drop the oldest
+    while len(provisioned) >= CHAT_ENGINE_CACHE_SIZE:
+        del provisioned[next(iter(provisioned))]
+
+    provisioned.pop(username, None)
+    provisioned[username] = (now + CHAT_ENGINE_CACHE_TTL, body)
+
+
+async def provision_user(username: str):
+    cached = provisioned.get(username)
+
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    data = {"username": username, "secret": username, "first_name": username}
+
+    for attempt in range(CHAT_ENGINE_RETRIES + 1):
+        try:
+            response = await get_client().put(CHAT_ENGINE_URL, data=data)
+
+            # Client errors will not get better on a retry
+            if response.status_code < 500:
+                break
+        except httpx.TransportError:
+            response = None
+
+        if attempt < CHAT_ENGINE_RETRIES:
+            await asyncio.sleep(CHAT_ENGINE_BACKOFF * 2 ** attempt)
+
+    if response is None or response.status_code >= 500:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY,
+                            detail="Chat engine is unavailable")
+
+    body = response.json()
+
+    if response.is_success and CHAT_ENGINE_CACHE_TTL > 0:
+        remember(username, body)
+
+    return body
@@ -0,0 +1,90 @@
+# Recomputes drifted denormalized counters and hot scores on posts in bulk batches.
+#
+#   python counters.py --batch-size 1000
+
+import argparse
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from database import sessionLocal
+from models import Post, PostComment, PostLike
+
+import ranking
+
+
+def reconcile(db: Session, counter, child_post, batch_size: int = 1000):
+    # Recomputes Post.<counter> as the number of child rows pointing at each post.
+    # Counting and writing is one UPDATE per batch, so a child row written meanwhile is
+    # either counted or applies its own increment afterwards, it is never overwritten.
+    fixed = 0
+    last_id = 0
+
+    actual = select(func.count()).select_from(child_post.table).where(
+        child_post == Post.id).scalar_subquery()
+
+    while True:
+        # Walk posts by primary key so every batch is a short, index-bound transaction
+        ids = db.scalars(select(Post.id).filter(Post.id > last_id).order_by(
+            Post.id).limit(batch_size)).all()
+
+        if not ids:
+            break
+
+        last_id = ids[-1]
+
+        result = db.execute(update(Post).where(Post.id.in_(ids), counter != actual).values(
+            {counter: actual}).execution_options(synchronize_session=False))
+        fixed += result.rowcount
+
+        db.commit()
+
+    return fixed
+
+
+def reconcile_comment_counts(db: Session, batch_size: int = 1000):
+    return reconcile(db, Post.comments_count, PostComment.post, batch_size)
+
+
+def reconcile_like_counts(db: Session, batch_size: int = 1000):
+    # Also repairs deltas lost by the like write-behind buffer when a worker dies.
+    # Deltas still pending in a running buffer are applied on top, run it while idle.
+    return reconcile(db, Post.likes, PostLike.post, batch_size)
+
+
+def rescore_hot_posts(db: Session, batch_size: int = 1000):
+    # Recomputes every hot score, e.g. after changing the weights or the decay
+    rescored = 0
+    last_id = 0
+
+    while True:
+        batch = db.query(*ranking.score_columns()).filter(Post.id > last_id).order_by(
+            Post.id).limit(batch_size).all()
+
+        if not batch:
+            break
+
+        last_id = batch[-1].id
+        scores = ranking.scores(batch)
+
+        db.execute(update(Post).where(Post.id.in_(scores)).values(
+            hot_score=case(scores, value=Post.id)))
+        db.commit()
+        rescored += len(scores)
+
+    return rescored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = sessionLocal()
+
+    try:
+        print(f"Reconciled comment counts on {reconcile_comment_counts(db, args.batch_size)} posts")
+        print(f"Reconciled like counts on {reconcile_like_counts(db, args.batch_size)} posts")
+        print(f"Rescored {rescore_hot_posts(db, args.batch_size)} posts")
+    finally:
+        db.close()
@@ -1,6 +1,15 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+
+from contextlib import contextmanager
+
+import metrics
 
 import os
 from dotenv import load_dotenv
@@ -9,9 +18,89 @@ from dotenv import load_dotenv
 load_dotenv()
 URL_DATABASE = os.getenv("URL_DATABASE")
 
+# Async drivers used by the API, e.g. mysql+pymysql:// -> mysql+aiomysql://
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+url = make_url(URL_DATABASE)
+ASYNC_URL_DATABASE = os.getenv("ASYNC_URL_DATABASE") or url.set(
+    drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+@compiles(functions.now, "sqlite")
+def sqlite_now(element, compiler, **kw):
+    # Match the "%Y-%m-%d %H:%M:%S.%f" format SQLAlchemy binds datetimes with on SQLite,
+    # otherwise server defaults sort before equal bound values in keyset comparisons
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
 
-engine = create_engine(URL_DATABASE)
+
+def pool_options(poolclass):
+    # SQLite allows one writer at a time and makes concurrent connections poll for the
+    # file lock, a single pooled connection queues them in the pool instead
+    if url.get_backend_name() == "sqlite":
+        return {"poolclass": poolclass, "pool_size": 1, "max_overflow": 0,
+                "pool_timeout": DB_POOL_TIMEOUT, "connect_args": {"timeout": DB_POOL_TIMEOUT}}
+
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+# The synchronous engine is used by scripts and schema management only
+engine = create_engine(URL_DATABASE, **pool_options(metrics.timed_pool(QueuePool)))
 
 sessionLocal = sessionmaker(autoflush=False, autocommit=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+async_engine = create_async_engine(ASYNC_URL_DATABASE,
+                                   **pool_options(metrics.timed_pool(AsyncAdaptedQueuePool)))
+
+metrics.instrument(engine)
+metrics.instrument(async_engine)
+
+# Objects stay usable after commit, reloading them would need another await
+asyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+
+async def get_db():
+    async with asyncSessionLocal() as db:
+        yield db
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(target=None):
+    # Counts SQL statements sent by the API (or `target` engine) inside the block, e.g.
+    #
+    #   with count_queries() as queries:
+    #       client.get("/posts/?limit=100")
+    #   assert queries.count == 2
+    target = (target or async_engine)
+    target = getattr(target, "sync_engine", target)
+    counter = QueryCounter()
+
+    event.listen(target, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(target, "before_cursor_execute", counter)
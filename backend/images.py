@@ -0,0 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+from sqlalchemy import String, type_coerce, update
+
+from starlette import status
+
+from cache import cache, post_key
+from database import asyncSessionLocal
+from models import Post, image_storage
+
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Responsive WebP variants generated for every uploaded post image
+IMAGE_VARIANT_WIDTHS = sorted(int(width) for width in
+                              os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(","))
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+# Resizing is CPU bound and holds the GIL, so it runs in separate processes
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Uploads are rejected while this many images wait for or are being processed
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", "64"))
+
+logger = logging.getLogger(__name__)
+
+executor = None
+tasks = set()
+pending = 0
+
+
+def render_variants(filename: str, widths: list, quality: int):
+    # Runs in a worker process, returns {width: filename} of the written variants.
+    # Variants are content addressed like their original, existing ones are reused.
+    variants = {}
+
+    with Image.open(image_storage.get_path(filename)) as original:
+        image = ImageOps.exif_transpose(original)
+
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        # Never upscale, images narrower than every width get a single re-encoded copy
+        targets = [width for width in widths if width < image.width] or [image.width]
+
+        for width in targets:
+            name = image_storage.derived_name(filename, f"{width}w", ".webp")
+            variants[str(width)] = name
+
+            if os.path.exists(image_storage.get_path(name)):
+                continue
+
+            variant = image.resize((width, max(image.height * width // image.width, 1)),
+                                   Image.LANCZOS)
+
+            tmp_path = image_storage.temp_path()
+            variant.save(tmp_path, format="WEBP", quality=quality)
+            os.replace(tmp_path, image_storage.get_path(name))
+
+    return variants
+
+
+def get_executor():
+    global executor
+
+    # Spawned lazily so workers do not inherit the event loop or pooled connections
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                       mp_context=multiprocessing.get_context("spawn"))
+
+    return executor
+
+
+def queue_depth():
+    return pending
+
+
+def reserve():
+    # Called before the upload is copied into the image storage. The request body has
+    # already been received by then, UploadLimitMiddleware bounds its size.
+    # Takes the slot right away so concurrent uploads cannot all pass the check, it is
+    # handed to schedule() or given back with release().
+    global pending
+
+    if pending >= IMAGE_MAX_PENDING:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many images are being processed, try again later")
+
+    pending += 1
+
+
+def release():
+    global pending
+
+    pending -= 1
+
+
+async def process(post_id: int, filename: str):
+    global pending
+
+    try:
+        variants = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), render_variants, filename, IMAGE_VARIANT_WIDTHS,
+            IMAGE_VARIANT_QUALITY)
+
+        async with asyncSessionLocal() as db:
+            # Skip the update if another image was uploaded in the meantime
+            await db.execute(update(Post).filter(
+                Post.id == post_id, Post.image_1 == type_coerce(filename, String)).values(
+                    image_variants=variants))
+            await db.commit()
+
+        await cache.delete(post_key(post_id))
+    except Exception:
+        logger.exception("Generating variants of %s for post %d failed", filename, post_id)
+    finally:
+        pending -= 1
+
+
+def schedule(post_id: int, filename: str):
+    # Uses the slot taken by reserve(), process() frees it when done
+    task = asyncio.create_task(process(post_id, filename))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+
+async def shutdown():
+    for task in list(tasks):
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
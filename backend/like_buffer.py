@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from sqlalchemy import case, update
+
+from cache import cache, post_key
+from database import asyncSessionLocal
+from models import Post
+
+import ranking
+
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Write-behind aggregation of post like counters. Like rows are still inserted per
+# request, only the `posts.likes` UPDATE is batched so hot posts stop serializing
+# on their row lock. Counters lag by at most one flush interval.
+LIKE_BUFFER_ENABLED = os.getenv("LIKE_BUFFER_ENABLED", "false").lower() == "true"
+LIKE_BUFFER_FLUSH_INTERVAL = float(os.getenv("LIKE_BUFFER_FLUSH_INTERVAL", "1"))
+LIKE_BUFFER_MAX_PENDING = int(os.getenv("LIKE_BUFFER_MAX_PENDING", "1000"))
+# Posts updated per UPDATE ... CASE statement
+LIKE_BUFFER_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    def __init__(self):
+        self.deltas = defaultdict(int)
+        self.pending = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.task = None
+
+    def add(self, post_id: int, delta: int):
+        self.deltas[post_id] += delta
+        self.pending += 1
+
+        if self.pending >= LIKE_BUFFER_MAX_PENDING:
+            self.wakeup.set()
+
+    async def flush(self):
+        if not self.deltas:
+            return
+
+        deltas, pending = dict(self.deltas), self.pending
+        self.deltas, self.pending = defaultdict(int), 0
+        deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+
+        started = time.perf_counter()
+        ids = list(deltas)
+
+        try:
+            async with asyncSessionLocal() as db:
+                for i in range(0, len(ids), LIKE_BUFFER_BATCH_SIZE):
+                    batch = {post_id: deltas[post_id] for post_id in ids[i:i + LIKE_BUFFER_BATCH_SIZE]}
+                    await db.execute(update(Post).filter(Post.id.in_(batch)).values(
+                        likes=Post.likes + case(batch, value=Post.id)).execution_options(
+                            synchronize_session=False))
+                await db.commit()
+        except Exception:
+            # Keep the deltas for the next attempt
+            for post_id, delta in deltas.items():
+                self.deltas[post_id] += delta
+            self.pending += pending
+            logger.exception("Flushing %d buffered like counters failed", len(deltas))
+            return
+
+        await cache.delete(*[post_key(post_id) for post_id in ids])
+        ranking.ranker.mark(*ids)
+
+        self.last_flush_seconds = time.perf_counter() - started
+        self.flush_seconds += self.last_flush_seconds
+        self.flushes += 1
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), LIKE_BUFFER_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # The loop is asked to finish instead of being cancelled, a cancelled flush
+        # would drop the deltas it has taken out of the buffer
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task, self.stopping = None, False
+
+        await self.flush()
+
+    def metrics(self):
+        return {
+            "pending_deltas": self.pending,
+            "pending_posts": len(self.deltas),
+            "flushes": self.flushes,
+            "flush_seconds_total": self.flush_seconds,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+buffer = LikeBuffer()
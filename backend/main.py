@@ -1,29 +1,53 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 from starlette import status 
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from pydantic import BaseModel
 
-import requests
-
 import os
 
 from dotenv import load_dotenv
 
-import models 
-from routers import auth, posts, comments
-from database import engine, sessionLocal
+import images
+import uploads
+import passwords
+import chat_engine
+import like_buffer
+import ranking
+import metrics
+import profiling
+from cache import cache
+from routers import auth, posts, comments, media, users, feed, admin, metrics as metrics_router
+from database import async_engine, get_db
 
 
 load_dotenv()
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if like_buffer.LIKE_BUFFER_ENABLED:
+        like_buffer.buffer.start()
+    ranking.ranker.start()
+
+    yield
+
+    await like_buffer.buffer.stop()
+    await ranking.ranker.stop()
+    await images.shutdown()
+    await chat_engine.close()
+    await cache.close()
+    await async_engine.dispose()
+    passwords.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -31,43 +55,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(uploads.UploadLimitMiddleware)
+if profiling.PROFILE_ENABLED:
+    app.add_middleware(profiling.ProfileMiddleware)
+# Added last so it wraps CORS too and times every request
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(posts.router)
 app.include_router(comments.router)
+app.include_router(media.router)
+app.include_router(users.router)
+app.include_router(feed.router)
+app.include_router(admin.router)
+app.include_router(metrics_router.router)
 
-models.Base.metadata.create_all(bind=engine)
+profiling.instrument(async_engine)
+
+metrics.register("cache", cache.metrics, counters=("hits", "misses", "evictions"))
+metrics.register("like_buffer", like_buffer.buffer.metrics,
+                 counters=("flushes", "flush_seconds_total"))
+metrics.register("hot_ranking", ranking.ranker.metrics, counters=("refreshes", "rescored_posts"))
+metrics.register("db_pool", lambda: {"size": async_engine.pool.size(),
+                                     "checked_out": async_engine.pool.checkedout(),
+                                     "overflow": async_engine.pool.overflow()})
+metrics.register("queue", lambda: {"password_hash_depth": passwords.queue_depth(),
+                                   "image_depth": images.queue_depth()})
 
 
 class User(BaseModel):
     username: str
 
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close()    
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends (auth.get_current_user)]
 
 
 @app.post('/authenticate')
 async def authenticate(user: User):
-    response = requests.put('https://api.chatengine.io/users/',
-        data={
-            "username": user.username,
-            "secret": user.username,
-            "first_name": user.username,
-        },
-        headers={ "Private-Key": PRIVATE_KEY }
-    )
-
-    return response.json()
+    return await chat_engine.provision_user(user.username)
 
 
 @app.post("/user", status_code=status.HTTP_200_OK)
@@ -0,0 +1,248 @@
+# Per-process request, SQL and connection pool instrumentation, exposed in the
+# Prometheus text format by GET /metrics. Recording is a few counter updates on the
+# event loop, all formatting happens when the endpoint is scraped.
+
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event, exc
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import anyio.to_thread
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+# Requests that matched no route share one label, so scanners cannot grow the series
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last slot counts observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestStats:
+    __slots__ = ("scope", "statements", "sql_seconds")
+
+    def __init__(self, scope: Scope = None):
+        self.scope = scope
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+# Stats of the request being served, shared with the greenlets and threads it runs SQL in
+current_request = ContextVar("current_request", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self.in_flight = 0
+        # (method, route, status) -> count
+        self.requests = {}
+        # (method, route) -> Histogram
+        self.latency = {}
+        self.sql_statements = {}
+        self.sql_seconds = {}
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.pool_wait = Histogram(POOL_WAIT_BUCKETS)
+        self.pool_timeouts = 0
+        # (prefix, fn, counters) of stats collected when scraped
+        self.collectors = []
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float,
+            stats: RequestStats):
+        key = (method, route)
+
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.sql_statements[key] = Histogram(STATEMENT_BUCKETS)
+            self.sql_seconds[key] = Histogram(LATENCY_BUCKETS)
+
+        self.latency[key].observe(seconds)
+        self.sql_statements[key].observe(stats.statements)
+        self.sql_seconds[key].observe(stats.sql_seconds)
+
+        key = (method, route, status_code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def register(self, prefix: str, fn, counters=()):
+        # fn returns a {name: value} dict, names in `counters` are exported as counters
+        self.collectors.append((prefix, fn, set(counters)))
+
+
+registry = Registry()
+
+
+def register(prefix: str, fn, counters=()):
+    registry.register(prefix, fn, counters)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+
+    elapsed = time.perf_counter() - started
+    registry.queries.observe(elapsed)
+
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+
+
+def instrument(engine):
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def timed_pool(poolclass):
+    # Subclass of `poolclass` timing how long checkouts wait for a connection,
+    # including opening a new one when the pool has room to grow
+    class TimedPool(poolclass):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                registry.pool_timeouts += 1
+                raise
+            finally:
+                registry.pool_wait.observe(time.perf_counter() - started)
+
+    TimedPool.__name__ = f"Timed{poolclass.__name__}"
+    return TimedPool
+
+
+def route_path(scope: Scope):
+    # The router leaves the matched route in the scope, its path template
+    # keeps one series per endpoint instead of one per id
+    return getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        registry.in_flight += 1
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.in_flight -= 1
+            current_request.reset(token)
+
+            registry.observe_request(scope["method"], route_path(scope), status_code, elapsed, stats)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_histogram(lines: list, name: str, help: str, series: dict, label_names=()):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} histogram")
+
+    for key, histogram in series.items():
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+
+        for bucket, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': bucket})} {cumulative}")
+
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+
+def format_metric(lines: list, name: str, kind: str, help: str, value):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name} {value}")
+
+
+def render():
+    # Must be called from the event loop, the thread limiter belongs to it
+    lines = []
+
+    lines.append("# HELP http_requests_total Requests served, by route template and status.")
+    lines.append("# TYPE http_requests_total counter")
+    for (method, route, status_code), count in registry.requests.items():
+        labels = format_labels({"method": method, "route": route, "status": status_code})
+        lines.append(f"http_requests_total{labels} {count}")
+
+    format_metric(lines, "http_requests_in_flight", "gauge",
+                  "Requests currently being served.", registry.in_flight)
+    format_histogram(lines, "http_request_duration_seconds", "Time to serve a request.",
+                     registry.latency, ("method", "route"))
+    format_histogram(lines, "http_request_sql_statements", "SQL statements run per request.",
+                     registry.sql_statements, ("method", "route"))
+    format_histogram(lines, "http_request_sql_seconds", "Time spent in SQL per request.",
+                     registry.sql_seconds, ("method", "route"))
+
+    format_histogram(lines, "db_query_duration_seconds", "Time to execute one SQL statement.",
+                     {(): registry.queries})
+    format_histogram(lines, "db_pool_checkout_wait_seconds",
+                     "Time spent waiting for a pooled connection.", {(): registry.pool_wait})
+    format_metric(lines, "db_pool_checkout_timeouts_total", "counter",
+                  "Checkouts that gave up after DB_POOL_TIMEOUT.", registry.pool_timeouts)
+
+    # Sync endpoints and dependencies share this limiter, a full one queues them
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    format_metric(lines, "threadpool_threads_limit", "gauge",
+                  "Threads available to sync endpoints.", limiter.total_tokens)
+    format_metric(lines, "threadpool_threads_busy", "gauge",
+                  "Threads running sync endpoints.", statistics.borrowed_tokens)
+    format_metric(lines, "threadpool_tasks_waiting", "gauge",
+                  "Sync calls waiting for a free thread.", statistics.tasks_waiting)
+
+    for prefix, fn, counters in registry.collectors:
+        for name, value in fn().items():
+            kind = "counter" if name in counters else "gauge"
+            if kind == "counter" and not name.endswith("_total"):
+                name = f"{name}_total"
+            format_metric(lines, f"{prefix}_{name}", kind, f"{prefix} {name}.", value)
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,47 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+import models
+from database import URL_DATABASE, engine, url
+
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Skip indexes limited to another dialect with ddl_if(), e.g. MySQL FULLTEXT
+    ddl_if = getattr(object, "_ddl_if", None)
+
+    return not (type_ == "index" and ddl_if is not None and ddl_if.dialect
+                and ddl_if.dialect != url.get_backend_name())
+
+
+def run_migrations_offline():
+    # Renders the SQL instead of running it: alembic upgrade head --sql
+    context.configure(url=URL_DATABASE, target_metadata=target_metadata,
+                      literal_binds=True, render_as_batch=True, include_object=include_object)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # SQLite cannot alter constraints in place, batch mode recreates the table instead
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          render_as_batch=True, include_object=include_object)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,96 @@
+"""initial schema
+
+The tables as Base.metadata.create_all created them before migrations were
+introduced. Databases created that way already have them, this revision leaves
+them as they are and the upgrade carries on with 0002.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def created_at():
+    return sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.func.now(),
+                     nullable=False)
+
+
+def upgrade() -> None:
+    # A database from create_all, `alembic upgrade head` runs on every container start
+    # and must not fail on one
+    if sa.inspect(op.get_bind()).has_table('users'):
+        return
+
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=63), nullable=True),
+        sa.Column('first_name', sa.String(length=63), nullable=True),
+        sa.Column('last_name', sa.String(length=63), nullable=True),
+        sa.Column('hashed_password', sa.String(length=127), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_index('ix_users_id', 'users', ['id'])
+
+    op.create_table('posts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.String(length=255), nullable=True),
+        sa.Column('likes', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('reposts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('saves', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('image_1', sa.Unicode(length=63), nullable=True),
+        created_at(),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_posts_id', 'posts', ['id'])
+
+    for table in ('post_comments', 'comment_comments'):
+        op.create_table(table,
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('post', sa.Integer(), nullable=False),
+            sa.Column('owner', sa.Integer(), nullable=False),
+            sa.Column('content', sa.String(length=255), nullable=False),
+            sa.Column('likes', sa.Integer(), server_default=sa.text('0'), nullable=False),
+            created_at(),
+            sa.Column('author_like', sa.Boolean(), server_default=sa.text('FALSE'), nullable=False),
+            *([sa.Column('comment', sa.Integer(), nullable=False),
+               sa.ForeignKeyConstraint(['comment'], ['post_comments.id'])]
+              if table == 'comment_comments' else []),
+            sa.ForeignKeyConstraint(['owner'], ['users.id']),
+            sa.ForeignKeyConstraint(['post'], ['posts.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(f'ix_{table}_id', table, ['id'])
+
+    for table, target, parent in (('post_likes', 'post', 'posts.id'),
+                                  ('comment_likes', 'comment', 'post_comments.id')):
+        op.create_table(table,
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('owner', sa.Integer(), nullable=False),
+            created_at(),
+            sa.Column(target, sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['owner'], ['users.id']),
+            sa.ForeignKeyConstraint([target], [parent]),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(f'ix_{table}_id', table, ['id'])
+
+
+def downgrade() -> None:
+    for table in ('comment_likes', 'post_likes', 'comment_comments', 'post_comments', 'posts', 'users'):
+        op.drop_index(f'ix_{table}_id', table_name=table)
+        op.drop_table(table)
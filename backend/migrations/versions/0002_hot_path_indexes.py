@@ -0,0 +1,164 @@
+"""hot path indexes, counters, media, follows and timelines
+
+Adds the composite indexes the keyset, feed, ranking and reconciliation queries
+seek on, the unique like indexes (duplicate likes are removed first) and the
+columns and tables added since the initial schema. Like and comment counters are
+recounted from their rows. Hot scores start at 0, fill them in with
+`python counters.py` after upgrading.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, index, columns), created on every dialect
+INDEXES = [
+    ('posts', 'ix_posts_created_at_id', ['created_at', 'id']),
+    ('posts', 'ix_posts_owner_id_created_at_id', ['owner_id', 'created_at', 'id']),
+    ('posts', 'ix_posts_hot_score_id', ['hot_score', 'id']),
+    ('post_comments', 'ix_post_comments_created_at_id', ['created_at', 'id']),
+    ('post_comments', 'ix_post_comments_post_created_at_id', ['post', 'created_at', 'id']),
+    ('comment_comments', 'ix_comment_comments_comment_created_at_id', ['comment', 'created_at', 'id']),
+    ('post_likes', 'ix_post_likes_post', ['post']),
+    ('comment_likes', 'ix_comment_likes_comment', ['comment']),
+]
+
+FULLTEXT_INDEXES = [
+    ('posts', 'ix_posts_content_fulltext', ['content']),
+    ('post_comments', 'ix_post_comments_content_fulltext', ['content']),
+]
+
+# (table, constraint, columns) of likes that must be unique per user
+UNIQUE_LIKES = [
+    ('post_likes', 'uq_post_likes_owner_post', ['owner', 'post']),
+    ('comment_likes', 'uq_comment_likes_owner_comment', ['owner', 'comment']),
+]
+
+
+def counter(column: str):
+    return sa.Column(column, sa.Integer(), server_default=sa.text('0'), nullable=False)
+
+
+def created_at():
+    return sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.func.now(),
+                     nullable=False)
+
+
+def recount(table: str, column: str, child: str, child_column: str):
+    parent, rows = sa.table(table, sa.column('id'), sa.column(column)), sa.table(child, sa.column(child_column))
+
+    op.execute(parent.update().values({column: sa.select(sa.func.count()).select_from(rows).where(
+        rows.c[child_column] == parent.c.id).scalar_subquery()}))
+
+
+def upgrade() -> None:
+    op.add_column('users', counter('followers_count'))
+    op.add_column('posts', counter('comments_count'))
+    op.add_column('posts', sa.Column('image_variants', sa.JSON(), nullable=True))
+    op.add_column('posts', sa.Column('hot_score', sa.Double(), server_default=sa.text('0'),
+                                     nullable=False))
+    op.add_column('post_comments', counter('replies_count'))
+
+    op.create_table('image_blobs',
+        sa.Column('name', sa.String(length=63), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        counter('refcount'),
+        created_at(),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+    op.create_table('follows',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('follower', sa.Integer(), nullable=False),
+        sa.Column('followee', sa.Integer(), nullable=False),
+        created_at(),
+        sa.ForeignKeyConstraint(['followee'], ['users.id']),
+        sa.ForeignKeyConstraint(['follower'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('follower', 'followee', name='uq_follows_follower_followee'),
+    )
+    op.create_index('ix_follows_id', 'follows', ['id'])
+    op.create_index('ix_follows_followee', 'follows', ['followee'])
+
+    op.create_table('timeline_entries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner', sa.Integer(), nullable=False),
+        sa.Column('post', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['owner'], ['users.id']),
+        sa.ForeignKeyConstraint(['post'], ['posts.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('owner', 'post', name='uq_timeline_entries_owner_post'),
+    )
+    op.create_index('ix_timeline_entries_id', 'timeline_entries', ['id'])
+    op.create_index('ix_timeline_entries_owner_created_at_post', 'timeline_entries',
+                    ['owner', 'created_at', 'post'])
+    op.create_index('ix_timeline_entries_post', 'timeline_entries', ['post'])
+
+    for table, name, columns in UNIQUE_LIKES:
+        # Keep the first like of every (owner, target), the derived table lets MySQL
+        # delete from the table it selects from
+        op.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT id FROM "
+                   f"(SELECT MIN(id) AS id FROM {table} GROUP BY {', '.join(columns)}) AS kept)")
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.create_unique_constraint(name, columns)
+
+    for table, name, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+    if op.get_context().dialect.name == 'mysql':
+        for table, name, columns in FULLTEXT_INDEXES:
+            op.create_index(name, table, columns, mysql_prefix='FULLTEXT')
+
+    recount('posts', 'likes', 'post_likes', 'post')
+    recount('posts', 'comments_count', 'post_comments', 'post')
+    recount('post_comments', 'likes', 'comment_likes', 'comment')
+    recount('post_comments', 'replies_count', 'comment_comments', 'comment')
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'mysql':
+        for table, name, columns in FULLTEXT_INDEXES:
+            op.drop_index(name, table_name=table)
+
+    for table, name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+
+    for table, name, columns in UNIQUE_LIKES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint(name, type_='unique')
+
+    op.drop_index('ix_timeline_entries_post', table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_owner_created_at_post', table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_id', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
+
+    op.drop_index('ix_follows_followee', table_name='follows')
+    op.drop_index('ix_follows_id', table_name='follows')
+    op.drop_table('follows')
+
+    op.drop_table('image_blobs')
+
+    with op.batch_alter_table('post_comments') as batch_op:
+        batch_op.drop_column('replies_count')
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('hot_score')
+        batch_op.drop_column('image_variants')
+        batch_op.drop_column('comments_count')
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('followers_count')
@@ -1,12 +1,25 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+from sqlalchemy import JSON, Boolean, Column, Double, Integer, String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
+from sqlalchemy.sql import func
 
-from fastapi_storages import FileSystemStorage
 from fastapi_storages.integrations.sqlalchemy import FileType
 
 from database import Base
+from storage import ContentAddressedStorage
+
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+IMAGE_STORAGE_PATH = os.getenv("IMAGE_STORAGE_PATH", "/static/images")
+# Public URL the storage directory is served under
+IMAGE_URL_PREFIX = os.getenv("IMAGE_URL_PREFIX", "/static/images")
+
+image_storage = ContentAddressedStorage(path=IMAGE_STORAGE_PATH)
 
 
 class User(Base):
@@ -17,6 +30,55 @@ class User(Base):
     first_name = Column(String(63))
     last_name = Column(String(63))
     hashed_password = Column(String(127))
+    # Decides between fanning posts out on write and merging them in on read
+    followers_count = Column(Integer, server_default = text("0"), nullable = False)
+
+
+class Follow(Base):
+    __tablename__ = "follows"
+
+    id = Column(Integer, primary_key=True, index=True)
+    follower = Column(Integer, ForeignKey("users.id"), nullable = False)
+    followee = Column(Integer, ForeignKey("users.id"), nullable = False)
+
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=func.now())
+
+    # The unique index also serves "who does X follow", fan-out looks up followers
+    __table_args__ = (
+        UniqueConstraint("follower", "followee", name="uq_follows_follower_followee"),
+        Index("ix_follows_followee", "followee"),
+    )
+
+
+class TimelineEntry(Base):
+    __tablename__ = "timeline_entries"
+
+    # Materialized home feed, one row per post fanned out to a follower
+    id = Column(Integer, primary_key=True, index=True)
+    owner = Column(Integer, ForeignKey("users.id"), nullable = False)
+    post = Column(Integer, ForeignKey("posts.id"), nullable = False)
+
+    # Copied from the post so timelines page exactly like posts
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("owner", "post", name="uq_timeline_entries_owner_post"),
+        Index("ix_timeline_entries_owner_created_at_post", "owner", "created_at", "post"),
+        Index("ix_timeline_entries_post", "post"),
+    )
+
+
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+
+    # Content addressed file name in image_storage, shared by every post with the same image
+    name = Column(String(63), primary_key=True)
+    size = Column(Integer, nullable = False)
+    refcount = Column(Integer, server_default = text("0"), nullable = False)
+
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=func.now())
 
 
 class Post(Base):
@@ -25,19 +87,43 @@ class Post(Base):
     id = Column(Integer, primary_key=True, index=True)
 
     owner_id = Column(Integer, ForeignKey("users.id"), nullable = False)
-    owner = relationship("User")
+    # Async sessions cannot lazy load, owners are fetched with the posts
+    owner = relationship("User", lazy="selectin")
 
     content = Column(String(255), nullable = True)
     likes = Column(Integer, server_default = text("0"), nullable = False)
     reposts = Column(Integer, server_default = text("0"), nullable = False)
     saves = Column(Integer, server_default = text("0"), nullable = False)
+    comments_count = Column(Integer, server_default = text("0"), nullable = False)
     comments = relationship("PostComment", backref = "post_comment")
+    # Maintained by ranking.ranker, see ranking.hot_score
+    hot_score = Column(Double, server_default = text("0"), nullable = False)
 
-    image_1 = Column(FileType(storage=FileSystemStorage(path="/static/images"), length=63), 
+    image_1 = Column(FileType(storage=image_storage, length=63), 
                      nullable = True)
+    # {width: filename} of the resized variants, filled in by the image workers
+    image_variants = Column(JSON, nullable = True)
     
     created_at = Column(TIMESTAMP(timezone=True),
-                        nullable=False, server_default=text('now()'))
+                        nullable=False, server_default=func.now())
+
+    # Keyset pagination seeks on (created_at, id), newest first
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        # Feeds read the newest posts of given authors
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index("ix_posts_hot_score_id", "hot_score", "id"),
+        Index("ix_posts_content_fulltext", "content", mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
+
+    @property
+    def image_url(self):
+        return f"{IMAGE_URL_PREFIX}/{self.image_1.name}" if self.image_1 else None
+
+    @property
+    def image_variant_urls(self):
+        return {width: f"{IMAGE_URL_PREFIX}/{name}"
+                for width, name in (self.image_variants or {}).items()}
     
 
 class Comment():
@@ -50,26 +136,41 @@ class Comment():
     likes = Column(Integer, server_default = text("0"), nullable = False)
 
     created_at = Column(TIMESTAMP(timezone=True),
-                        nullable=False, server_default=text('now()'))
+                        nullable=False, server_default=func.now())
     author_like = Column(Boolean, server_default = text("FALSE"), nullable = False)
 
 
 class PostComment(Base, Comment):
     __tablename__ = "post_comments"
 
+    replies_count = Column(Integer, server_default = text("0"), nullable = False)
+
+    __table_args__ = (
+        Index("ix_post_comments_created_at_id", "created_at", "id"),
+        # Comment trees page through the comments of one post
+        Index("ix_post_comments_post_created_at_id", "post", "created_at", "id"),
+        Index("ix_post_comments_content_fulltext", "content",
+              mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
+
 
 class CommentOnComment(Base, Comment):
     __tablename__ = "comment_comments"
     
     comment = Column(Integer, ForeignKey("post_comments.id"), nullable = False)
 
+    # Replies are fetched and paged per parent comment
+    __table_args__ = (
+        Index("ix_comment_comments_comment_created_at_id", "comment", "created_at", "id"),
+    )
+
 
 class Like():
     id = Column(Integer, primary_key=True, index=True)
     owner = Column(Integer, ForeignKey("users.id"), nullable = False)
 
     created_at = Column(TIMESTAMP(timezone=True),
-                        nullable=False, server_default=text('now()'))
+                        nullable=False, server_default=func.now())
 
 
 class PostLike(Base, Like):
@@ -77,8 +178,20 @@ class PostLike(Base, Like):
 
     post = Column(Integer, ForeignKey("posts.id"), nullable = False)
 
+    # One like per user, also lets a duplicate like fail on insert without a lookup
+    __table_args__ = (
+        UniqueConstraint("owner", "post", name="uq_post_likes_owner_post"),
+        # Counter reconciliation counts likes per post
+        Index("ix_post_likes_post", "post"),
+    )
+
 
 class CommentLike(Base, Like):
     __tablename__ = "comment_likes"
     
     comment = Column(Integer, ForeignKey("post_comments.id"), nullable = False)
+
+    __table_args__ = (
+        UniqueConstraint("owner", "comment", name="uq_comment_likes_owner_comment"),
+        Index("ix_comment_likes_comment", "comment"),
+    )
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import or_
+
+from starlette import status
+
+import base64
+import json
+
+
+def encode_cursor(value, id: int):
+    # Opaque token holding the sort key (created_at or a score) and id of the last
+    # row on the page
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value, id]).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key: str = "created_at"):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+        return datetime.fromisoformat(value) if key == "created_at" else float(value), int(id)
+
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid pagination cursor")
+
+
+def seek(query, model, cursor: str, limit: int, key: str = "created_at"):
+    # Newest (or highest `key`) first. Rows after the cursor are found through the
+    # (key, id) index instead of scanning and discarding `skip` rows like OFFSET does.
+    column = getattr(model, key)
+    query = query.order_by(column.desc(), model.id.desc())
+
+    if cursor:
+        value, id = decode_cursor(cursor, key)
+        # The redundant `key <= ?` gives the planner a range bound on the index
+        query = query.filter(column <= value, or_(column < value, model.id < id))
+
+    return query.limit(limit)
+
+
+def next_cursor(rows: list, limit: int, key: str = "created_at"):
+    if len(rows) < limit:
+        return None
+
+    last = rows[-1]
+    return encode_cursor(getattr(last, key), last.id)
+
+
+def parse_ids(ids: str, limit: int = 100):
+    # "1,2,3" -> [1, 2, 3], order kept and duplicates dropped
+    try:
+        parsed = list(dict.fromkeys(int(id) for id in ids.split(",") if id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="ids must be a comma separated list of integers")
+
+    if len(parsed) > limit:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {limit} ids can be requested at once")
+
+    return parsed
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from starlette import status
+
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# bcrypt releases the GIL, so a thread pool keeps hashing off the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1)
+# Requests waiting for a worker beyond this are rejected instead of piling up
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "256"))
+
+bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                              thread_name_prefix="password-hash")
+
+in_flight = 0
+
+
+def queue_depth():
+    # Hash jobs submitted but not yet picked up by a worker
+    return max(in_flight - PASSWORD_HASH_WORKERS, 0)
+
+
+async def _run(fn, *args):
+    global in_flight
+
+    if queue_depth() >= PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many concurrent authentication requests")
+
+    in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        in_flight -= 1
+
+
+async def hash_password(password: str):
+    return await _run(bcrypt_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses
+    # deprecated settings and should be replaced
+    return await _run(bcrypt_context.verify_and_update, password, hashed_password)
+
+
+def shutdown():
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,223 @@
+# Opt-in profiling. With SLOW_QUERY_SECONDS set, statements slower than it are logged
+# with their route and EXPLAIN plan. With PROFILE_ENABLED, admins can send
+# "X-Profile: 1" to get a sampled stack profile of their request instead of its body.
+# Nothing is hooked in when both are off.
+
+from collections import Counter
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import event
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import metrics
+from routers import auth
+
+
+load_dotenv()
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS") or 0)
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+# Bound values include password hashes and private content, only their types are
+# logged unless this is turned on
+SLOW_QUERY_LOG_PARAMETERS = os.getenv("SLOW_QUERY_LOG_PARAMETERS", "false").lower() == "true"
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+# Statements EXPLAIN accepts on both SQLite and MySQL
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+logger = logging.getLogger(__name__)
+
+
+def explain(conn, statement: str, parameters):
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+
+    # A raw cursor of the same connection, so the plan sees the same transaction
+    # and the EXPLAIN itself does not fire the cursor events again
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" | ".join(str(value) for value in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def describe_parameters(parameters, executemany: bool):
+    if SLOW_QUERY_LOG_PARAMETERS:
+        return repr(parameters)
+
+    if executemany:
+        return f"{len(parameters)} parameter sets"
+
+    values = list(parameters.values() if isinstance(parameters, dict) else parameters or ())
+    return f"{len(values)} ({', '.join(type(value).__name__ for value in values)})"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["slow_query_started"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("slow_query_started", None)
+    if started is None:
+        return
+
+    elapsed = time.perf_counter() - started
+    if elapsed < SLOW_QUERY_SECONDS:
+        return
+
+    stats = metrics.current_request.get()
+    route = "background"
+    if stats is not None and stats.scope is not None:
+        route = f"{stats.scope['method']} {metrics.route_path(stats.scope)}"
+
+    plan = "not explained"
+
+    # Server side cursors still have rows to send, the connection cannot run another query
+    if (SLOW_QUERY_EXPLAIN and not executemany and statement.lstrip().lower().startswith(EXPLAINABLE)
+            and not (context is not None and context.execution_options.get("stream_results"))):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as error:
+            plan = f"EXPLAIN failed: {error}"
+
+    logger.warning("Slow query (%.1f ms) in %s:\n%s\nparameters: %s\nplan:\n%s",
+                   elapsed * 1000, route, statement, describe_parameters(parameters, executemany), plan)
+
+
+def instrument(engine):
+    if not SLOW_QUERY_SECONDS:
+        return
+
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def thread_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def awaiting_stack(task: asyncio.Task):
+    # Follows the coroutines a suspended task is awaiting down to the pending future
+    stack = []
+    coro = task.get_coro()
+
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+
+    return stack + ["[awaiting]"]
+
+
+class Sampler:
+    # Samples the stack of one request's task from a separate thread. Samples taken
+    # while the task runs show the event loop thread's stack, samples taken while it
+    # is suspended show what it awaits (database, cache, a worker pool).
+    def __init__(self, task: asyncio.Task, interval: float = PROFILE_INTERVAL):
+        self.task = task
+        self.loop = task.get_loop()
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+
+    def sample(self):
+        # asyncio keeps the running task of each loop here, the C implementation included
+        if asyncio.tasks._current_tasks.get(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = thread_stack(frame)
+        else:
+            stack = awaiting_stack(self.task)
+
+        if stack:
+            self.stacks[";".join(stack)] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self):
+        # One "frame;frame;frame count" line per stack, the input of flamegraph.pl,
+        # speedscope and similar tools
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def authorize(scope: Scope):
+    headers = dict(scope["headers"])
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    await auth.get_admin_user(await auth.get_current_user(token))
+
+
+class ProfileMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not any(name == b"x-profile" for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await authorize(scope)
+        except HTTPException as error:
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        status_code = 500
+
+        # The profile replaces the response, which is discarded
+        async def discard(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        started = time.perf_counter()
+
+        with Sampler(asyncio.current_task()) as sampler:
+            await self.app(scope, receive, discard)
+
+        elapsed = time.perf_counter() - started
+        response = PlainTextResponse(sampler.collapsed(), headers={
+            "x-profile-status": str(status_code),
+            "x-profile-samples": str(sum(sampler.stacks.values())),
+            "x-profile-duration-ms": f"{elapsed * 1000:.1f}",
+        })
+        await response(scope, receive, send)
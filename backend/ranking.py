@@ -0,0 +1,125 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import case, select, update
+
+from database import asyncSessionLocal
+from models import Post
+
+import asyncio
+import logging
+import math
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Hot scores are log10(engagement) plus the post's age in units of HOT_DECAY_SECONDS,
+# so a post needs 10x the engagement to rank with one HOT_DECAY_SECONDS newer. The
+# age term only grows with created_at, scores change only when counters do.
+HOT_DECAY_SECONDS = float(os.getenv("HOT_DECAY_SECONDS", "45000"))
+# Upper bound on how long a counter change takes to reach the score
+HOT_REFRESH_INTERVAL = float(os.getenv("HOT_REFRESH_INTERVAL", "5"))
+HOT_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+SAVE_WEIGHT = 2
+REPOST_WEIGHT = 3
+
+# Posts rescored per UPDATE ... CASE statement
+HOT_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def hot_score(likes: int, comments_count: int, reposts: int, saves: int, created_at: datetime = None):
+    engagement = (likes * LIKE_WEIGHT + comments_count * COMMENT_WEIGHT +
+                  reposts * REPOST_WEIGHT + saves * SAVE_WEIGHT)
+    created_at = created_at or datetime.now(timezone.utc)
+
+    # SQLite hands back naive timestamps, they are UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+
+    return math.log10(max(engagement, 1)) + (created_at - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def score_columns():
+    return Post.id, Post.likes, Post.comments_count, Post.reposts, Post.saves, Post.created_at
+
+
+def scores(rows):
+    return {row.id: hot_score(row.likes, row.comments_count, row.reposts, row.saves, row.created_at)
+            for row in rows}
+
+
+class HotRanking:
+    # Collects posts whose counters changed and rescores them in batches
+    def __init__(self):
+        self.dirty = set()
+        self.refreshes = 0
+        self.rescored = 0
+        self.stopping = asyncio.Event()
+        self.task = None
+
+    def mark(self, *post_ids: int):
+        self.dirty.update(post_ids)
+
+    async def refresh(self):
+        if not self.dirty:
+            return
+
+        ids, self.dirty = list(self.dirty), set()
+
+        try:
+            async with asyncSessionLocal() as db:
+                for i in range(0, len(ids), HOT_BATCH_SIZE):
+                    rows = await db.execute(select(*score_columns()).filter(
+                        Post.id.in_(ids[i:i + HOT_BATCH_SIZE])))
+                    batch = scores(rows)
+
+                    if batch:
+                        await db.execute(update(Post).filter(Post.id.in_(batch)).values(
+                            hot_score=case(batch, value=Post.id)).execution_options(
+                                synchronize_session=False))
+                await db.commit()
+        except Exception:
+            self.dirty.update(ids)
+            logger.exception("Rescoring %d posts failed", len(ids))
+            return
+
+        self.refreshes += 1
+        self.rescored += len(ids)
+
+    async def run(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), HOT_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+            await self.refresh()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # The loop is asked to finish instead of being cancelled, a cancelled refresh
+        # would lose the posts it has taken out of the dirty set
+        if self.task is not None:
+            self.stopping.set()
+            await self.task
+            self.task = None
+            self.stopping.clear()
+
+        await self.refresh()
+
+    def metrics(self):
+        return {"pending_posts": len(self.dirty), "refreshes": self.refreshes,
+                "rescored_posts": self.rescored}
+
+
+ranker = HotRanking()
@@ -0,0 +1,106 @@
+from datetime import datetime
+from typing import Literal
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import TypeDecorator, select, type_coerce
+
+from database import asyncSessionLocal
+from models import Post, PostComment, PostLike, CommentLike
+from routers import auth
+
+import csv
+import io
+import json
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Rows read per session. Each chunk is a short read of its own, an export never
+# holds a connection while the client downloads.
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+
+EXPORT_MODELS = {model.__tablename__: model for model in (Post, PostComment, PostLike, CommentLike)}
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+
+def export_columns(model):
+    # Stored values, e.g. image file names instead of the storage objects FileType loads
+    return [type_coerce(column, column.type.impl).label(column.name)
+            if isinstance(column.type, TypeDecorator) else column
+            for column in model.__table__.columns]
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+async def export_rows(model, format: str):
+    # Walks the table in id order, one keyset chunk per session. A chunk is read whole
+    # and its session closed before it is sent, so a slow client never holds a
+    # connection and memory is bounded by the chunk size. Rows written after their
+    # chunk was read are not included.
+    columns = export_columns(model)
+    names = [column.name for column in columns]
+    last_id = 0
+
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+
+    while True:
+        async with asyncSessionLocal() as db:
+            rows = (await db.execute(select(*columns).filter(model.id > last_id).order_by(
+                model.id).limit(EXPORT_CHUNK_SIZE))).all()
+
+        if rows:
+            last_id = rows[-1].id
+
+            if format == "csv":
+                writer.writerows([csv_value(value) for value in row] for row in rows)
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk = "".join(json.dumps(dict(zip(names, row)), default=json_default) + "\n"
+                                for row in rows)
+
+            yield chunk
+
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            break
+
+    # CSV has the header left to send when the table is empty
+    if format == "csv" and buffer.getvalue():
+        yield buffer.getvalue()
+
+
+@router.get("/export/{table}")
+async def export_table(table: Literal["posts", "post_comments", "post_likes", "comment_likes"],
+        format: Literal["ndjson", "csv"] = "ndjson", current_user: dict = Depends(auth.get_admin_user)):
+
+    # The rows are read while the response is sent, by sessions of the generator's own:
+    # the request's session is closed before streaming starts
+    return StreamingResponse(export_rows(EXPORT_MODELS[table], format), media_type=MEDIA_TYPES[format],
+                             headers={"content-disposition": f'attachment; filename="{table}.{format}"'})
@@ -5,19 +5,24 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status 
 
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 
 import database
 import models
+import passwords
+from cache import LRUCache
 
-from database import sessionLocal 
+from database import get_db
 from models import User
 
+import hashlib
 import os
+import time
 
 from dotenv import load_dotenv
 
@@ -33,7 +38,13 @@ router = APIRouter(
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM =os.getenv("ALGORITHM")
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "true").lower() == "true"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Comma separated usernames allowed to use admin-only features
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+bcrypt_context = passwords.bcrypt_context
+token_cache = LRUCache(max_entries=TOKEN_CACHE_SIZE)
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
 
@@ -49,40 +60,42 @@ class Token (BaseModel):
     token_type: str
 
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, create_user_request: CreateUserRequest):
     
-    user = db.query(User).filter(User.username == create_user_request.username).first()
+    user = (await db.execute(select(User).filter(
+        User.username == create_user_request.username))).scalars().first()
 
     if user:
         raise HTTPException(status_code=400, detail="User with such username already exists")
+
+    # Give the connection back to the pool while the password is being hashed
+    await db.commit()
     
     create_user_model = User(
         username=create_user_request.username,
         first_name=create_user_request.first_name,
         last_name=create_user_request.last_name,
-        hashed_password=bcrypt_context.hash(create_user_request.password)
+        hashed_password=await passwords.hash_password(create_user_request.password)
     )
     
     db.add(create_user_model)
-    db.commit()
+
+    # A concurrent registration may have taken the name while the password was hashed
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="User with such username already exists")
 
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
         db: db_dependency):
     
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate user.')
@@ -91,13 +104,24 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
     return {"access_token": token, "token_type": "bearer"}
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(username: str, password: str, db):
+    user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
 
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+
+    # Give the connection back to the pool while the password is being verified
+    await db.commit()
+
+    valid, new_hash = await passwords.verify_password(password, user.hashed_password)
+
+    if not valid:
         return False
+
+    # Transparently upgrade hashes made with deprecated settings
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     return user
 
@@ -115,9 +139,28 @@ def create_access_token(username: str, user_id: int, expires_delta: timedelta |
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+async def decode_token(token: str):
+    if not TOKEN_CACHE_ENABLED:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+    # Verified claims are reused until the token expires, keyed by digest so the
+    # cache never holds usable tokens
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = await token_cache.get(key)
+
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        ttl = payload.get("exp", 0) - time.time()
+
+        if ttl > 0:
+            await token_cache.set(key, payload, ttl)
+
+    return payload
+
+
 async def get_current_user(token: Annotated[str, Depends (oauth2_bearer)]):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = await decode_token(token)
 
         username: str = payload.get ('sub')
         user_id: int = payload.get('id')
@@ -129,12 +172,19 @@ async def get_current_user(token: Annotated[str, Depends (oauth2_bearer)]):
         return {'username': username, 'id': user_id}
     
     except JWTError:
-        raise HTTPException(status_code=status.HTTP._401_UNAUTHORIZED,
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Could not validate user. ')
 
-def verify_token(token: str = Depends(oauth2_bearer)):
+async def get_admin_user(user: Annotated[dict, Depends(get_current_user)]):
+    if user["username"] not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+            detail='Admin privileges required.')
+
+    return user
+
+async def verify_token(token: str = Depends(oauth2_bearer)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = await decode_token(token)
         username: str = payload.get ("sub")
         if username is None:
             raise HTTPException(status_code=403, detail="Token is invalid or expired")
@@ -144,5 +194,5 @@ def verify_token(token: str = Depends(oauth2_bearer)):
 
 @router.get("/verify-token/{token}")
 async def verify_user_token(token: str):
-    verify_token(token)
+    await verify_token(token)
     return {"message": "Token is valid"}
@@ -1,21 +1,29 @@
 from datetime import timedelta, datetime, timezone
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, func, select, update, delete
+from sqlalchemy.exc import IntegrityError
 
 from starlette import status 
 
+from collections import Counter
+
 from pydantic import BaseModel
 
 import database
 import models
 
-from database import sessionLocal 
-from models import User, Post, PostComment, CommentLike
+from database import get_db
+from models import User, Post, PostComment, CommentOnComment, CommentLike
 
 import schemas
+import pagination
+import search as search_index
+import ranking
+import bulk
+from cache import cache, comment_key, post_key
 from routers import auth
 
 import os
@@ -30,54 +38,146 @@ router = APIRouter(
     tags=["comments"]
 )
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+
+async def insert_comments(db: AsyncSession, owner: int, comments: List[schemas.CommentBulkCreate]):
+    # Every post's counter is bumped by its number of new comments in one UPDATE
+    counts = Counter(comment.post for comment in comments)
+
+    updated = await db.execute(update(Post).filter(Post.id.in_(counts)).values(
+        comments_count=Post.comments_count + case(counts, value=Post.id)).execution_options(
+            synchronize_session=False))
+
+    if updated.rowcount != len(counts):
+        existing = set((await db.execute(select(Post.id).filter(Post.id.in_(counts)))).scalars())
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"posts with ids: {sorted(set(counts) - existing)} do not exist")
+
+    ids = await bulk.insert_many(db, PostComment, [{"owner": owner, **comment.dict()}
+                                                   for comment in comments])
+    await db.commit()
+
+    for id, comment in zip(ids, comments):
+        search_index.index(PostComment, id, comment.content)
+
+    await cache.delete(*[post_key(post_id) for post_id in counts])
+    ranking.ranker.mark(*counts)
+
+    return ids
+
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=List[schemas.Comment])
+async def create_comments_bulk(comments: List[schemas.CommentBulkCreate], db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    bulk.check_size(comments)
+    ids = await insert_comments(db, current_user["id"], comments)
+
+    created = {comment.id: comment for comment in (await db.execute(
+        select(PostComment).filter(PostComment.id.in_(ids)))).scalars()}
+
+    return [created[id] for id in ids]
+
 
-db_dependency = Annotated[Session, Depends(get_db)]
+@router.post("/bulk/ndjson", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkImport)
+async def import_comments(request: Request, db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    # One CommentBulkCreate object per line, inserted as they arrive
+    return await bulk.import_ndjson(request, schemas.CommentBulkCreate,
+                                    lambda comments: insert_comments(db, current_user["id"], comments))
 
 
 @router.post("/{post_id}", status_code=status.HTTP_201_CREATED, response_model=schemas.Comment)
-def create_comment(post_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+async def create_comment(post_id: int, comment: schemas.CommentCreate, db: AsyncSession = Depends(get_db), current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    # Bump the denormalized counter in the same transaction as the insert
+    updated = await db.execute(update(Post).filter(Post.id == post_id).values(
+        comments_count=Post.comments_count + 1).execution_options(synchronize_session=False))
+
+    if not updated.rowcount:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"post with id: {post_id} does not exist")
 
     new_comment = PostComment(owner=current_user["id"], post=post_id, **comment.dict())
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
+    await db.commit()
+    await db.refresh(new_comment)
+
+    search_index.index(PostComment, new_comment.id, new_comment.content)
+    # The post carries the comment counter
+    await cache.delete(post_key(post_id))
+    ranking.ranker.mark(post_id)
 
     return new_comment
 
 
-@router.get("/", response_model=List[schemas.Comment])
-def get_comments(db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user), limit: int = 10, skip: int = 0, search: Optional[str] = ""):
+@router.get("/", response_model=Union[List[schemas.Comment], schemas.CommentPage])
+async def get_comments(db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user), limit: int = 10, skip: int = 0, search: Optional[str] = "", cursor: Optional[str] = None):
+
+    comments_query = select(PostComment)
+
+    # Cursor mode: pass an empty cursor for the first page, then the returned next_cursor
+    if cursor is not None:
+        if search:
+            comments_query = comments_query.filter(
+                await search_index.matches(db, PostComment, search))
+
+        comments = (await db.execute(
+            pagination.seek(comments_query, PostComment, cursor, limit))).scalars().all()
+
+        return {"items": comments, "next_cursor": pagination.next_cursor(comments, limit)}
 
-    comments = db.query(PostComment).group_by(PostComment.id).filter(PostComment.content.contains(search)).limit(limit).offset(skip).all()
+    # Searches are ordered by relevance
+    if search:
+        ids = await search_index.ranked_ids(db, PostComment, search, limit, skip)
+        comments = {comment.id: comment for comment in (await db.execute(
+            comments_query.filter(PostComment.id.in_(ids)))).scalars()}
+
+        return [comments[id] for id in ids if id in comments]
+
+    comments = (await db.execute(comments_query.limit(limit).offset(skip))).scalars().all()
     
     return comments
 
 
+@router.get("/batch/likes", response_model=schemas.LikeStates)
+async def get_like_states(ids: str, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user)):
+
+    ids = pagination.parse_ids(ids)
+    liked = set((await db.execute(select(CommentLike.comment).filter(
+        CommentLike.owner == current_user["id"], CommentLike.comment.in_(ids)))).scalars())
+
+    return {"liked": {id: id in liked for id in ids}}
+
+
 @router.get("/{id}", response_model=schemas.Comment)
-def get_comment(id: int, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
+async def get_comment(id: int, db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
+
+    # Serialized payloads are cached, hits skip both the query and the validation
+    cached = await cache.get(comment_key(id))
+
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
 
-    comment = db.query(PostComment).group_by(PostComment.id).filter(PostComment.id == id).first()
+    comment = (await db.execute(select(PostComment).filter(PostComment.id == id))).scalars().first()
 
     if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Comment with id: {id} was not found")
 
-    return comment  
+    payload = schemas.Comment.model_validate(comment, from_attributes=True).model_dump_json()
+    await cache.set(comment_key(id), payload.encode())
 
+    return Response(content=payload, media_type="application/json")
 
-@router.put("/{id}", response_model=schemas.Comment)
-def update_comment(id: int, updated_comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
 
-    comment_query = db.query(PostComment).filter(PostComment.id == id)
+@router.put("/{id}", response_model=schemas.Comment)
+async def update_comment(id: int, updated_comment: schemas.CommentCreate, db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
 
-    comment = comment_query.first()
+    comment = (await db.execute(select(PostComment).filter(PostComment.id == id))).scalars().first()
 
     if comment == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -87,19 +187,22 @@ def update_comment(id: int, updated_comment: schemas.CommentCreate, db: Session
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Not authorized to perform requested action")
 
-    comment_query.update(updated_comment.dict(), synchronize_session=False)
+    await db.execute(update(PostComment).filter(PostComment.id == id).values(
+        **updated_comment.dict()))
 
-    db.commit()
+    await db.commit()
+    await db.refresh(comment)
 
-    return comment_query.first()
+    search_index.index(PostComment, id, updated_comment.content)
+    await cache.delete(comment_key(id))
 
+    return comment
 
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_comment(id: int, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
 
-    comment_query = db.query(PostComment).filter(PostComment.id == id)
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_comment(id: int, db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
 
-    comment = comment_query.first()
+    comment = (await db.execute(select(PostComment).filter(PostComment.id == id))).scalars().first()
 
     if comment == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -109,70 +212,101 @@ def delete_comment(id: int, db: Session = Depends(get_db), current_user: int = D
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Not authorized to perform requested action")
 
-    comment_query.delete(synchronize_session=False)
-    db.commit()
+    # Replies only exist under their comment
+    await db.execute(delete(CommentOnComment).filter(CommentOnComment.comment == id))
+    await db.execute(delete(PostComment).filter(PostComment.id == id))
+    await db.execute(update(Post).filter(Post.id == comment.post).values(
+        comments_count=Post.comments_count - 1).execution_options(synchronize_session=False))
+    await db.commit()
+
+    search_index.unindex(PostComment, id)
+    await cache.delete(comment_key(id), post_key(comment.post))
+    ranking.ranker.mark(comment.post)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@router.post("/{id}/replies", status_code=status.HTTP_201_CREATED, response_model=schemas.Reply)
+async def create_reply(id: int, reply: schemas.CommentCreate, db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    # Bump the denormalized counter in the same transaction as the insert
+    updated = await db.execute(update(PostComment).filter(PostComment.id == id).values(
+        replies_count=PostComment.replies_count + 1).execution_options(synchronize_session=False))
+
+    if not updated.rowcount:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Comment with id: {id} does not exist")
+
+    post_id = (await db.execute(select(PostComment.post).filter(PostComment.id == id))).scalar()
+
+    new_reply = CommentOnComment(owner=current_user["id"], post=post_id, comment=id, **reply.dict())
+    db.add(new_reply)
+    await db.commit()
+    await db.refresh(new_reply)
+
+    # The comment carries the reply counter
+    await cache.delete(comment_key(id))
+
+    return new_reply
+
+
+@router.get("/{id}/replies", response_model=schemas.ReplyPage)
+async def get_replies(id: int, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user), limit: int = 10, cursor: str = ""):
+
+    replies_query = select(CommentOnComment).filter(CommentOnComment.comment == id)
+
+    replies = (await db.execute(
+        pagination.seek(replies_query, CommentOnComment, cursor, limit))).scalars().all()
+
+    return {"items": replies, "next_cursor": pagination.next_cursor(replies, limit)}
+
+
 @router.post("/{id}/like", status_code=status.HTTP_201_CREATED, response_model=schemas.CommentLike)
-def create_like(id: int, db: Session = Depends(get_db),
+async def create_like(id: int, db: AsyncSession = Depends(get_db),
         current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
-    # The comment that being liked
-    liked_comment = db.query(PostComment).filter(PostComment.id == id).first()
+    # Increment the number of likes in SQL, concurrent likes cannot overwrite each other
+    liked = await db.execute(update(PostComment).filter(PostComment.id == id).values(
+        likes=PostComment.likes + 1).execution_options(synchronize_session=False))
 
-    if liked_comment == None:
+    if not liked.rowcount:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"The comment with id: {id} does not exist")
-    
-    # Check wether like object already exists
-    like_query = db.query(CommentLike).group_by(CommentLike.id).filter(
-        CommentLike.owner == current_user["id"], CommentLike.comment == id).first()
 
-    if like_query is not None:
+    # The unique (owner, comment) index rejects a second like and rolls back the increment
+    new_like = CommentLike(owner=current_user["id"], comment=id)
+    db.add(new_like)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"You cannot like one comment twice")
 
-    # Create like object
-    new_like = CommentLike(owner=current_user["id"], comment=id)
-    # Increment the number of likes on the post
-    liked_comment.likes += 1
-    
-    db.add(new_like)
-    db.commit()
-    db.refresh(new_like)
+    await cache.delete(comment_key(id))
+    await db.refresh(new_like)
 
     return new_like
 
 
 @router.delete("/{id}/like", status_code=status.HTTP_204_NO_CONTENT)
-def delete_like(id: int, db: Session = Depends(get_db),
+async def delete_like(id: int, db: AsyncSession = Depends(get_db),
         current_user: int = Depends(auth.get_current_user)):
     
-    # The post where the like is being deleted
-    comment = db.query(PostComment).filter(PostComment.id == id).first()
-
-    if comment is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Comment with id: {id} does not exist")
-
-    if comment.owner != current_user["id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
-    
-    like_query = db.query(CommentLike).filter(CommentLike.owner == current_user["id"],
-        CommentLike.comment == id)
-    like = like_query.first()
+    # Delete the like and decrement the number of likes in the same transaction
+    deleted = await db.execute(delete(CommentLike).filter(
+        CommentLike.owner == current_user["id"], CommentLike.comment == id))
     
-    # Check wether like object already exists
-    if like is None:
+    if not deleted.rowcount:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"like on comment with id: {id} does not exist")
     
-    # Delete the like and decrement the number of likes on the post
-    like_query.delete(synchronize_session=False)
-    comment.likes -= 1
+    await db.execute(update(PostComment).filter(PostComment.id == id).values(
+        likes=PostComment.likes - 1).execution_options(synchronize_session=False))
 
-    db.commit()
+    await db.commit()
+    await cache.delete(comment_key(id))
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from database import get_db
+from models import Post
+
+import schemas
+import pagination
+import timeline
+from routers import auth
+
+
+router = APIRouter(
+    prefix="/feed",
+    tags=["feed"]
+)
+
+
+@router.get("", response_model=schemas.PostPage)
+async def get_feed(db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user),
+        limit: int = 10, cursor: str = ""):
+
+    # Posts of followed users and the reader's own, newest first
+    page = (await db.execute(timeline.feed(current_user["id"], cursor, limit))).all()
+
+    ids = [row.id for row in page]
+    posts = {post.id: post
+             for post in (await db.execute(select(Post).filter(Post.id.in_(ids)))).scalars()}
+
+    return {"items": [{"Post": posts[id]} for id in ids if id in posts],
+            "next_cursor": pagination.next_cursor(page, limit)}
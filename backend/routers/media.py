@@ -0,0 +1,163 @@
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import PurePath
+
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from starlette import status
+from starlette.types import Receive, Scope, Send
+
+import aiofiles
+import aiofiles.os
+
+import models
+
+
+router = APIRouter(
+    prefix="/static/images",
+    tags=["media"]
+)
+
+# Stored names are derived from the content, so a URL always serves the same bytes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# The only types served, anything else stored under the image directory is a 404.
+# Browsers must not sniff a different type out of the bytes.
+MEDIA_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+               ".gif": "image/gif", ".webp": "image/webp"}
+NOSNIFF = {"x-content-type-options": "nosniff"}
+
+
+class MediaResponse(Response):
+    # Streams bytes [start, end] of a file. Servers implementing the ASGI zero-copy
+    # extension get the file descriptor and sendfile() it, others get chunked reads.
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict,
+            media_type: str):
+        self.path = path
+        self.start = start
+        self.length = end - start + 1
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**headers, "content-length": str(self.length)})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code,
+                    "headers": self.raw_headers})
+
+        extensions = scope.get("extensions") or {}
+
+        if scope["method"] == "HEAD" or not self.length:
+            await send({"type": "http.response.body", "body": b""})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.start, "count": self.length})
+        elif "http.response.pathsend" in extensions and self.status_code == status.HTTP_200_OK:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            async with aiofiles.open(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                remaining = self.length
+
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    remaining = remaining - len(chunk) if chunk else 0
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": bool(remaining)})
+
+
+def not_modified(request: Request, etag: str, mtime: int):
+    if_none_match = request.headers.get("if-none-match")
+
+    # If-None-Match takes precedence over If-Modified-Since, and compares weakly: a
+    # W/ tag matches the strong tag with the same value
+    if if_none_match:
+        return if_none_match.strip() == "*" or etag in [
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    try:
+        return int(parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()) >= mtime
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def byte_range(request: Request, headers: dict, size: int):
+    # Returns the requested (start, end) or None for the whole file. Only single
+    # ranges are served, anything else falls back to the full file.
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+
+    if not range_header or (if_range and if_range not in (headers["etag"], headers["last-modified"])):
+        return None
+
+    unit, _, ranges = range_header.partition("=")
+
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+
+    first, _, last = (part.strip() for part in ranges.partition("-"))
+
+    # Invalid ranges are ignored and the whole file is sent, only valid ones that do not
+    # overlap the file are answered with 416
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+
+        if last and end < start:
+            return None
+
+        satisfiable = start < size
+    else:
+        start, end = max(size - int(last), 0), size - 1
+        satisfiable = int(last) > 0 and size > 0
+
+    if not satisfiable:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}", **NOSNIFF})
+
+    return start, min(end, size - 1)
+
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+async def get_image(name: str, request: Request):
+
+    path = models.image_storage.get_path(name)
+    media_type = MEDIA_TYPES.get(PurePath(name).suffix.lower())
+
+    try:
+        if media_type is None or models.image_storage.get_name(name) != name:
+            raise FileNotFoundError(name)
+        stat_result = await aiofiles.os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"image {name} was not found", headers=NOSNIFF)
+
+    mtime = int(stat_result.st_mtime)
+
+    # The name is the content hash, which makes it a strong validator
+    headers = {
+        "etag": f'"{name}"',
+        "last-modified": formatdate(mtime, usegmt=True),
+        "cache-control": IMMUTABLE_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+        **NOSNIFF,
+    }
+
+    if not_modified(request, headers["etag"], mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = stat_result.st_size
+    requested = byte_range(request, headers, size)
+
+    if requested is None:
+        return MediaResponse(path, 0, size - 1, status.HTTP_200_OK, headers, media_type)
+
+    start, end = requested
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    return MediaResponse(path, start, end, status.HTTP_206_PARTIAL_CONTENT, headers, media_type)
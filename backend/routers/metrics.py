@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from starlette import status
+
+import secrets
+import os
+
+from dotenv import load_dotenv
+
+import metrics
+
+
+load_dotenv()
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"]
+)
+
+
+@router.get("", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics(request: Request):
+
+    if METRICS_TOKEN and not secrets.compare_digest(
+            request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Could not validate credentials")
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
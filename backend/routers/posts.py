@@ -1,23 +1,30 @@
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Literal, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, File
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import String, func, select, update, delete, type_coerce
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from starlette import status 
 
-import aiofiles
-
 import database
 import models
-from database import sessionLocal 
-from models import User, Post, PostComment, PostLike
+from database import get_db
+from models import User, Post, PostComment, CommentOnComment, PostLike, TimelineEntry
 
 import schemas
+import pagination
+import search as search_index
+import timeline
+import images
+import like_buffer
+import ranking
+import uploads
+import bulk
+from cache import cache, post_key
 from routers import auth
 
-import string
-import random
 import os
 
 from dotenv import load_dotenv
@@ -30,61 +37,205 @@ router = APIRouter(
     tags=["posts"]
 )
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
-def create_posts(post: schemas.PostCreate, db: Session = Depends(get_db),
+async def create_posts(post: schemas.PostCreate, db: AsyncSession = Depends(get_db),
         current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
 
-    new_post = Post(owner_id=current_user["id"], **post.dict())
+    # A new post starts with the score of no engagement at its creation time
+    new_post = Post(owner_id=current_user["id"], hot_score=ranking.hot_score(0, 0, 0, 0), **post.dict())
 
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    await db.flush()
+
+    # Copy the post into the followers' timelines in the same transaction
+    await timeline.fan_out(db, new_post.id)
+    await db.commit()
+    await db.refresh(new_post)
+
+    search_index.index(Post, new_post.id, new_post.content)
 
     return new_post
 
 
-@router.get("/", response_model=List[schemas.PostOut])
-def get_posts(db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user), 
-        limit: int = 10, skip: int = 0, search: Optional[str] = ""):
+async def insert_posts(db: AsyncSession, owner_id: int, posts: List[schemas.PostCreate]):
+    hot_score = ranking.hot_score(0, 0, 0, 0)
+    ids = await bulk.insert_many(db, Post, [{"owner_id": owner_id, "hot_score": hot_score, **post.dict()}
+                                           for post in posts])
+
+    await timeline.fan_out(db, *ids)
+    await db.commit()
+
+    for id, post in zip(ids, posts):
+        search_index.index(Post, id, post.content)
+
+    return ids
+
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=List[schemas.Post])
+async def create_posts_bulk(posts: List[schemas.PostCreate], db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    # One multi-row INSERT and one timeline fan-out for the whole list, in one transaction
+    bulk.check_size(posts)
+    ids = await insert_posts(db, current_user["id"], posts)
+
+    created = {post.id: post for post in (await db.execute(select(Post).filter(Post.id.in_(ids)))).scalars()}
+
+    return [created[id] for id in ids]
+
+
+@router.post("/bulk/ndjson", status_code=status.HTTP_201_CREATED, response_model=schemas.BulkImport)
+async def import_posts(request: Request, db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    # One PostCreate object per line, inserted as they arrive
+    return await bulk.import_ndjson(request, schemas.PostCreate,
+                                    lambda posts: insert_posts(db, current_user["id"], posts))
+
+
+@router.get("/", response_model=Union[List[schemas.PostOut], schemas.PostPage])
+async def get_posts(db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user), 
+        limit: int = 10, skip: int = 0, search: Optional[str] = "", cursor: Optional[str] = None,
+        sort: Optional[Literal["hot"]] = None):
+
+    posts_query = select(Post)
+
+    # Hot posts first, always cursor paginated. Scores lag counters by at most
+    # ranking.HOT_REFRESH_INTERVAL, a post can move between pages meanwhile.
+    if sort == "hot":
+        if search:
+            posts_query = posts_query.filter(await search_index.matches(db, Post, search))
+
+        posts = (await db.execute(pagination.seek(
+            posts_query, Post, cursor or "", limit, key="hot_score"))).scalars().all()
 
-    posts = db.query(Post, func.count(PostComment.post).label("post_comments")).join(
-        PostComment, PostComment.post == Post.id, isouter=True).group_by(Post.id).filter(
-            Post.content.contains(search)).limit(limit).offset(skip).all()
+        return {"items": [{"Post": post} for post in posts],
+                "next_cursor": pagination.next_cursor(posts, limit, key="hot_score")}
+
+    # Cursor mode: pass an empty cursor for the first page, then the returned next_cursor
+    if cursor is not None:
+        if search:
+            posts_query = posts_query.filter(await search_index.matches(db, Post, search))
+
+        posts = (await db.execute(pagination.seek(posts_query, Post, cursor, limit))).scalars().all()
+
+        return {"items": [{"Post": post} for post in posts],
+                "next_cursor": pagination.next_cursor(posts, limit)}
+
+    # Searches are ordered by relevance
+    if search:
+        ids = await search_index.ranked_ids(db, Post, search, limit, skip)
+        posts = {post.id: post
+                 for post in (await db.execute(posts_query.filter(Post.id.in_(ids)))).scalars()}
+
+        return [{"Post": posts[id]} for id in ids if id in posts]
+
+    posts = (await db.execute(posts_query.limit(limit).offset(skip))).scalars().all()
     
-    return posts
+    return [{"Post": post} for post in posts]
+
+
+@router.get("/batch", response_model=List[schemas.PostOut])
+async def get_posts_batch(ids: str, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user)):
+
+    # ids=1,2,3 in one query with the owners joined, returned in the requested order
+    ids = pagination.parse_ids(ids)
+    posts = {post.id: post for post in (await db.execute(select(Post).options(
+        joinedload(Post.owner)).filter(Post.id.in_(ids)))).scalars()}
+
+    return [{"Post": posts[id]} for id in ids if id in posts]
+
+
+@router.get("/batch/likes", response_model=schemas.LikeStates)
+async def get_like_states(ids: str, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user)):
+
+    ids = pagination.parse_ids(ids)
+    liked = set((await db.execute(select(PostLike.post).filter(
+        PostLike.owner == current_user["id"], PostLike.post.in_(ids)))).scalars())
+
+    return {"liked": {id: id in liked for id in ids}}
 
 
 @router.get("/{id}", response_model=schemas.PostOut)
-def get_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
+async def get_post(id: int, db: AsyncSession = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
+
+    # Serialized payloads are cached, hits skip both the query and the validation
+    cached = await cache.get(post_key(id))
+
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
 
-    post = db.query(Post, func.count(PostComment.post).label("post_comments")).join(
-        PostComment, PostComment.post == Post.id, isouter=True).group_by(Post.id).filter(Post.id == id).first()
+    # A single row, joining the owner saves the separate selectin query
+    post = (await db.execute(select(Post).options(joinedload(Post.owner)).filter(
+        Post.id == id))).scalars().first()
 
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"post with id: {id} was not found")
 
-    return post  
+    payload = schemas.PostOut.model_validate({"Post": post}, from_attributes=True).model_dump_json()
+    await cache.set(post_key(id), payload.encode())
+
+    return Response(content=payload, media_type="application/json")
+
+
+@router.get("/{id}/comments/tree", response_model=schemas.CommentTree)
+async def get_comment_tree(id: int, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user),
+        limit: int = Query(20, ge=1, le=100), cursor: str = "",
+        depth: int = Query(2, ge=1, le=2), replies_limit: int = Query(3, ge=0, le=50)):
+
+    # One page of comments, then the newest `replies_limit` replies of each of them in
+    # a single windowed query, two statements whatever the size of the thread
+    comments = (await db.execute(pagination.seek(
+        select(PostComment).filter(PostComment.post == id), PostComment, cursor, limit))).scalars().all()
+
+    if not comments and not cursor:
+        if (await db.execute(select(Post.id).filter(Post.id == id))).first() is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"post with id: {id} does not exist")
+
+    replies = {comment.id: [] for comment in comments}
+    parents = [comment.id for comment in comments if comment.replies_count]
+
+    if depth > 1 and replies_limit and parents:
+        rank = func.row_number().over(partition_by=CommentOnComment.comment, order_by=(
+            CommentOnComment.created_at.desc(), CommentOnComment.id.desc())).label("rank")
+        ranked = select(CommentOnComment.id, rank).filter(
+            CommentOnComment.comment.in_(parents)).subquery()
+
+        for reply in (await db.execute(select(CommentOnComment).join(
+                ranked, ranked.c.id == CommentOnComment.id).filter(
+                    ranked.c.rank <= replies_limit).order_by(ranked.c.rank))).scalars():
+            replies[reply.comment].append(reply)
+
+    items = []
+
+    for comment in comments:
+        shown = replies[comment.id]
+        replies_next_cursor = None
+
+        if comment.replies_count > len(shown):
+            # An empty cursor starts from the newest reply
+            replies_next_cursor = pagination.encode_cursor(
+                shown[-1].created_at, shown[-1].id) if shown else ""
+
+        items.append({**schemas.Comment.model_validate(comment, from_attributes=True).model_dump(),
+                      "replies": shown, "replies_next_cursor": replies_next_cursor})
+
+    return {"items": items, "next_cursor": pagination.next_cursor(comments, limit)}
 
 
 @router.put("/{id}", response_model=schemas.Post)
-def update_post(id: int, updated_post: schemas.PostCreate, db: Session = Depends(get_db),
+async def update_post(id: int, updated_post: schemas.PostCreate, db: AsyncSession = Depends(get_db),
         current_user: int = Depends(auth.get_current_user)):
 
-    post_query = db.query(Post).filter(Post.id == id)
-
-    post = post_query.first()
+    post = (await db.execute(select(Post).filter(Post.id == id))).scalars().first()
 
     if post == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -94,20 +245,22 @@ def update_post(id: int, updated_post: schemas.PostCreate, db: Session = Depends
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Not authorized to perform requested action")
 
-    post_query.update(updated_post.dict(), synchronize_session=False)
+    await db.execute(update(Post).filter(Post.id == id).values(**updated_post.dict()))
 
-    db.commit()
+    await db.commit()
+    await db.refresh(post)
 
-    return post_query.first()
+    search_index.index(Post, id, updated_post.content)
+    await cache.delete(post_key(id))
+
+    return post
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int, db: Session = Depends(get_db),
+async def delete_post(id: int, db: AsyncSession = Depends(get_db),
         current_user: int = Depends(auth.get_current_user)):
 
-    post_query = db.query(Post).filter(Post.id == id)
-
-    post = post_query.first()
+    post = (await db.execute(select(Post).filter(Post.id == id))).scalars().first()
 
     if post == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -117,97 +270,134 @@ def delete_post(id: int, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Not authorized to perform requested action")
 
-    post_query.delete(synchronize_session=False)
+    await db.execute(delete(TimelineEntry).filter(TimelineEntry.post == id))
+    await db.execute(delete(Post).filter(Post.id == id))
+
+    # Images are shared between posts with the same content, the last post removes the file
+    if post.image_1:
+        await uploads.release(db, models.image_storage, post.image_1.name)
     
-    db.commit()
+    await db.commit()
+
+    search_index.unindex(Post, id)
+    await cache.delete(post_key(id))
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.post("/{id}/like", status_code=status.HTTP_201_CREATED, response_model=schemas.PostLike)
-def create_like(id: int, db: Session = Depends(get_db),
+async def create_like(id: int, db: AsyncSession = Depends(get_db),
         current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
-    # The post that being liked
-    liked_post = db.query(Post).filter(Post.id == id).first()
-
-    if liked_post == None:
+    if like_buffer.LIKE_BUFFER_ENABLED:
+        # The counter is flushed in batches, only check that the post exists
+        liked = await db.execute(select(Post.id).filter(Post.id == id))
+        found = liked.first() is not None
+    else:
+        # Increment the number of likes in SQL, concurrent likes cannot overwrite each other
+        liked = await db.execute(update(Post).filter(Post.id == id).values(
+            likes=Post.likes + 1).execution_options(synchronize_session=False))
+        found = liked.rowcount > 0
+
+    if not found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"post with id: {id} does not exist")
-    
-    # Check wether like object already exists
-    like_query = db.query(PostLike).group_by(PostLike.id).filter(
-        PostLike.owner == current_user["id"], PostLike.post == id).first()
 
-    if like_query is not None:
+    # The unique (owner, post) index rejects a second like and rolls back the increment
+    new_like = PostLike(owner=current_user["id"], post=id)
+    db.add(new_like)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"You cannot like one post twice")
 
-    # Create like object
-    new_like = PostLike(owner=current_user["id"], post=id)
-    # Increment the number of likes on the post
-    liked_post.likes += 1
-    
-    db.add(new_like)
-    db.commit()
-    db.refresh(new_like)
+    # Buffered counters invalidate the cache and rescore when they are flushed
+    if like_buffer.LIKE_BUFFER_ENABLED:
+        like_buffer.buffer.add(id, 1)
+    else:
+        await cache.delete(post_key(id))
+        ranking.ranker.mark(id)
+
+    await db.refresh(new_like)
 
     return new_like
 
 
 @router.delete("/{id}/like", status_code=status.HTTP_204_NO_CONTENT)
-def delete_like(id: int, db: Session = Depends(get_db),
+async def delete_like(id: int, db: AsyncSession = Depends(get_db),
         current_user: int = Depends(auth.get_current_user)):
     
-    # The post where the like is being deleted
-    post = db.query(Post).filter(Post.id == id).first()
-
-    if post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post with id: {id} does not exist")
-
-    if post.owner_id != current_user["id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
-    
-    like_query = db.query(PostLike).filter(PostLike.owner == current_user["id"], PostLike.post == id)
-    like = like_query.first()
+    # Delete the like and decrement the number of likes in the same transaction
+    deleted = await db.execute(delete(PostLike).filter(
+        PostLike.owner == current_user["id"], PostLike.post == id))
     
-    # Check wether like object already exists
-    if like is None:
+    if not deleted.rowcount:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"like on post with id: {id} does not exist")
     
-    # Delete the like and decrement the number of likes on the post
-    like_query.delete(synchronize_session=False)
-    post.likes -= 1
+    if not like_buffer.LIKE_BUFFER_ENABLED:
+        await db.execute(update(Post).filter(Post.id == id).values(
+            likes=Post.likes - 1).execution_options(synchronize_session=False))
+
+    await db.commit()
 
-    db.commit()
+    if like_buffer.LIKE_BUFFER_ENABLED:
+        like_buffer.buffer.add(id, -1)
+    else:
+        await cache.delete(post_key(id))
+        ranking.ranker.mark(id)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.post('/{id}/upload-image')
-async def upload_image(id: int, db: Session = Depends(get_db), image: UploadFile = File(...),
+async def upload_image(id: int, db: AsyncSession = Depends(get_db), image: UploadFile = File(...),
         current_user: int = Depends(auth.get_current_user)):
     
-    post = db.query(Post).filter(Post.id == id).first()
+    post = (await db.execute(select(Post).filter(Post.id == id))).scalars().first()
 
     if post == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Post with id: {id} does not exist")
-    
-    content = image.read()
 
-    letters = string.ascii_letters
+    if post.owner_id != current_user["id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Not authorized to perform requested action")
 
-    rand_str = ''.join(random.choice(letters) for i in range(8))
-    new = f'_{rand_str}.'
+    images.reserve()
 
-    filename = new.join(image.filename.rsplit('.', 1))
-    
-    async with aiofiles.open(os.path.join('app/static/images', filename), mode='wb') as f:
-        await f.write(content)
-        
-    post.image_1 = filename    
+    try:
+        # Release the connection while the upload is streamed to disk
+        await db.commit()
+
+        stored = await uploads.save_upload(db, image, models.image_storage)
+
+        current = (await db.execute(select(Post.image_1).filter(Post.id == id).with_for_update())).first()
+
+        if current is None:
+            await uploads.release(db, models.image_storage, stored["filename"])
+            await db.commit()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Post with id: {id} does not exist")
+
+        # The file is already stored, bypass FileType which would copy it again
+        await db.execute(update(Post).filter(Post.id == id).values(
+            image_1=type_coerce(stored["filename"], String), image_variants=None))
+
+        if current.image_1:
+            await uploads.release(db, models.image_storage, current.image_1.name)
+
+        await db.commit()
+
+        await cache.delete(post_key(id))
+
+        # Variants are generated in the background and show up on the post when ready
+        images.schedule(id, stored["filename"])
+    except BaseException:
+        # Gives the slot back on errors and on cancelled requests alike
+        images.release()
+        raise
 
-    return {'filename': post.image_1}
+    return stored
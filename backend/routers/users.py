@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+
+from starlette import status 
+
+from database import get_db
+from models import User, Follow
+
+import schemas
+import timeline
+from routers import auth
+
+
+router = APIRouter(
+    prefix="/users",
+    tags=["users"]
+)
+
+
+@router.post("/{id}/follow", status_code=status.HTTP_201_CREATED, response_model=schemas.Follow)
+async def follow(id: int, db: AsyncSession = Depends(get_db),
+        current_user: schemas.CreateUserRequest = Depends(auth.get_current_user)):
+
+    if id == current_user["id"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="You cannot follow yourself")
+
+    updated = await db.execute(update(User).filter(User.id == id).values(
+        followers_count=User.followers_count + 1).execution_options(synchronize_session=False))
+
+    if not updated.rowcount:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"user with id: {id} does not exist")
+
+    # The unique (follower, followee) index rejects a second follow and the increment
+    new_follow = Follow(follower=current_user["id"], followee=id)
+    db.add(new_follow)
+
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"You already follow user with id: {id}")
+
+    await timeline.backfill(db, current_user["id"], id)
+    await db.commit()
+    await db.refresh(new_follow)
+
+    return new_follow
+
+
+@router.delete("/{id}/follow", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow(id: int, db: AsyncSession = Depends(get_db),
+        current_user: int = Depends(auth.get_current_user)):
+
+    deleted = await db.execute(delete(Follow).filter(
+        Follow.follower == current_user["id"], Follow.followee == id))
+
+    if not deleted.rowcount:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"You do not follow user with id: {id}")
+
+    await db.execute(update(User).filter(User.id == id).values(
+        followers_count=User.followers_count - 1).execution_options(synchronize_session=False))
+    await timeline.remove(db, current_user["id"], id)
+    await db.commit()
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
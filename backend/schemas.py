@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, FilePath
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pydantic.types import conint
 
@@ -47,6 +47,9 @@ class Post(PostBase):
     likes: int
     reposts: int
     saves: int
+    comments_count: int
+    image_url: Optional[str] = None
+    image_variant_urls: Dict[str, str] = {}
     created_at: datetime
     
     class Config:
@@ -57,6 +60,20 @@ class PostOut(BaseModel):
     Post: Post
 
 
+class PostPage(BaseModel):
+    items: List[PostOut]
+    next_cursor: Optional[str] = None
+
+
+class BulkImport(BaseModel):
+    created: int
+
+
+class LikeStates(BaseModel):
+    # Requested id -> whether the current user likes it
+    liked: Dict[int, bool]
+
+
 class CommentBase(BaseModel):
     content: str
 
@@ -66,6 +83,7 @@ class Comment(CommentBase):
     post: int
     owner: int
     likes: int
+    replies_count: int
     author_like: bool
     created_at: datetime
 
@@ -74,6 +92,41 @@ class CommentCreate(CommentBase):
     pass
 
 
+class CommentBulkCreate(CommentCreate):
+    post: int
+
+
+class CommentPage(BaseModel):
+    items: List[Comment]
+    next_cursor: Optional[str] = None
+
+
+class Reply(CommentBase):
+    id: int
+    post: int
+    comment: int
+    owner: int
+    likes: int
+    author_like: bool
+    created_at: datetime
+
+
+class ReplyPage(BaseModel):
+    items: List[Reply]
+    next_cursor: Optional[str] = None
+
+
+class CommentNode(Comment):
+    replies: List[Reply] = []
+    # Continue with GET /comments/{id}/replies?cursor=replies_next_cursor
+    replies_next_cursor: Optional[str] = None
+
+
+class CommentTree(BaseModel):
+    items: List[CommentNode]
+    next_cursor: Optional[str] = None
+
+
 class PostLikeBase(BaseModel):
     post: int
 
@@ -100,3 +153,10 @@ class CommentLike(CommentLikeBase):
 
 class CommentLikeCreate(CommentLikeBase):
     pass
+
+
+class Follow(BaseModel):
+    id: int
+    follower: int
+    followee: int
+    created_at: datetime
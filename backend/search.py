@@ -0,0 +1,159 @@
+from collections import Counter, defaultdict
+from threading import Lock
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from models import Post, PostComment
+
+import heapq
+import math
+import os
+import re
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# "fulltext" uses MySQL FULLTEXT indexes with MATCH ... AGAINST, "memory" keeps an
+# in-process inverted index per worker and is meant for SQLite and test setups
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND") or (
+    "fulltext" if engine.dialect.name == "mysql" else "memory")
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(content: str):
+    return TOKEN_RE.findall((content or "").lower())
+
+
+class InvertedIndex:
+    # BM25 tuning constants
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.lengths = {}
+        self.total_length = 0
+        self.built = False
+        self.lock = Lock()
+
+    def _remove(self, id: int):
+        if id not in self.lengths:
+            return
+
+        self.total_length -= self.lengths.pop(id)
+
+        for term in self.doc_terms.pop(id):
+            del self.postings[term][id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def _add(self, id: int, content: str):
+        self._remove(id)
+        terms = Counter(tokenize(content))
+
+        for term, freq in terms.items():
+            self.postings[term][id] = freq
+
+        self.doc_terms[id] = set(terms)
+        self.lengths[id] = sum(terms.values())
+        self.total_length += self.lengths[id]
+
+    def build(self, rows):
+        with self.lock:
+            if self.built:
+                return
+
+            for id, content in rows:
+                self._add(id, content)
+            self.built = True
+
+    def add(self, id: int, content: str):
+        with self.lock:
+            self._add(id, content)
+
+    def remove(self, id: int):
+        with self.lock:
+            self._remove(id)
+
+    def search(self, query: str, limit: int = None):
+        with self.lock:
+            count = len(self.lengths)
+            if not count:
+                return []
+
+            avg_length = self.total_length / count or 1
+            scores = defaultdict(float)
+
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+
+                idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+
+                for id, freq in docs.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.lengths[id] / avg_length)
+                    scores[id] += idf * freq * (self.K1 + 1) / (freq + norm)
+
+        # Highest score first, newest first among equal scores
+        key = lambda id: (scores[id], id)
+
+        if limit is not None:
+            return heapq.nlargest(limit, scores, key=key)
+
+        return sorted(scores, key=key, reverse=True)
+
+
+indexes = {Post: InvertedIndex(), PostComment: InvertedIndex()}
+
+
+async def _get_index(db: AsyncSession, model):
+    index = indexes[model]
+
+    if not index.built:
+        index.build((await db.execute(select(model.id, model.content))).all())
+
+    return index
+
+
+def _match(model, query: str):
+    return match(model.content, against=query).in_natural_language_mode()
+
+
+async def matches(db: AsyncSession, model, query: str):
+    # WHERE clause selecting the rows that match `query`, in no particular order
+    if SEARCH_BACKEND == "fulltext":
+        return _match(model, query)
+
+    return model.id.in_((await _get_index(db, model)).search(query))
+
+
+async def ranked_ids(db: AsyncSession, model, query: str, limit: int, skip: int = 0):
+    # Ids of matching rows, most relevant first
+    if SEARCH_BACKEND == "fulltext":
+        score = _match(model, query)
+        rows = await db.execute(select(model.id).filter(score).order_by(
+            score.desc(), model.id.desc()).limit(limit).offset(skip))
+
+        return list(rows.scalars())
+
+    return (await _get_index(db, model)).search(query, skip + limit)[skip:]
+
+
+def index(model, id: int, content: str):
+    # MySQL maintains FULLTEXT indexes itself, the in-process index is updated here.
+    # An index that has not been built yet will pick the row up when it is.
+    if SEARCH_BACKEND == "memory" and indexes[model].built:
+        indexes[model].add(id, content)
+
+
+def unindex(model, id: int):
+    if SEARCH_BACKEND == "memory" and indexes[model].built:
+        indexes[model].remove(id)
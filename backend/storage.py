@@ -0,0 +1,56 @@
+from pathlib import Path
+from typing import BinaryIO
+
+from fastapi_storages import FileSystemStorage
+
+import uuid
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Files are named after a hash of their content and sharded on its first two
+    # bytes, e.g. "3fa9c0...png" is stored at 3f/a9/3fa9c0...png. Names stay flat in
+    # the database, only the location on disk is sharded.
+
+    def shard(self, name: str) -> Path:
+        name = self.get_name(name)
+        return self._path / name[:2] / name[2:4]
+
+    def temp_path(self) -> str:
+        # Same filesystem as the shards, so moving a finished file in is atomic
+        return str(self._path / f".upload-{uuid.uuid4().hex}.tmp")
+
+    def get_path(self, name: str) -> str:
+        return str(self.shard(name) / self.get_name(name))
+
+    def get_size(self, name: str) -> int:
+        return Path(self.get_path(name)).stat().st_size
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self.get_path(name), "rb")
+
+    def write(self, file: BinaryIO, name: str) -> str:
+        self.shard(name).mkdir(parents=True, exist_ok=True)
+        path = self.get_path(name)
+
+        file.seek(0, 0)
+        with open(path, "wb") as output:
+            while chunk := file.read(self.default_chunk_size):
+                output.write(chunk)
+
+        return path
+
+    def derived_name(self, name: str, label: str, suffix: str) -> str:
+        # Files generated from a blob, e.g. 3fa9c0..._png_320w.webp, share its shard
+        # and include its full name so blobs that only differ in extension never clash
+        return f"{self.get_name(name).replace('.', '_')}_{label}{suffix}"
+
+    def remove(self, name: str):
+        # Removes the file and everything derived from it
+        Path(self.get_path(name)).unlink(missing_ok=True)
+
+        for path in self.shard(name).glob(self.derived_name(name, "*", "")):
+            path.unlink(missing_ok=True)
+
+    def generate_new_filename(self, filename: str) -> str:
+        # Equal names mean equal content, there is nothing to rename
+        return self.get_name(filename)
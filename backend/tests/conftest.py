@@ -0,0 +1,17 @@
+# The app reads its settings when imported. Tests run it against a scratch database and
+# image directory, set here before any test module imports it and never taken from .env.
+
+import os
+import tempfile
+
+
+scratch = tempfile.mkdtemp(prefix="social-tests-")
+
+os.environ.update({
+    "URL_DATABASE": f"sqlite:///{scratch}/test.db",
+    "IMAGE_STORAGE_PATH": os.path.join(scratch, "images"),
+    "SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+    # Concurrent requests queue on the single SQLite connection
+    "DB_POOL_TIMEOUT": "600",
+})
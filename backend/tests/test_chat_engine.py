@@ -0,0 +1,147 @@
+# chat_engine against a local stand-in for the chat engine API, served from a thread
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import chat_engine
+
+
+class StandIn(ThreadingHTTPServer):
+    def __init__(self, statuses):
+        super().__init__(("127.0.0.1", 0), Handler)
+        # Status of each successive PUT, the last one repeats
+        self.statuses = list(statuses)
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/users/"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        server = self.server
+        status = server.statuses[min(server.requests, len(server.statuses) - 1)]
+        server.requests += 1
+
+        body = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(*statuses):
+        server = StandIn(statuses)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    # Records backoff delays instead of sleeping through them
+    recorded = []
+
+    async def sleep(seconds):
+        recorded.append(seconds)
+
+    monkeypatch.setattr(chat_engine, "asyncio", SimpleNamespace(sleep=sleep))
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_RETRIES", 3)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_BACKOFF", 0.2)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_CACHE_TTL", 300)
+    monkeypatch.setattr(chat_engine, "provisioned", {})
+    return recorded
+
+
+def provision(username: str = "alice"):
+    async def go():
+        try:
+            return await chat_engine.provision_user(username)
+        finally:
+            await chat_engine.close()
+
+    return asyncio.run(go())
+
+
+def closed_port_url():
+    # A port nothing listens on, connecting to it fails
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/users/"
+
+
+def test_retries_server_errors_with_backoff(stand_in, delays, monkeypatch):
+    server = stand_in(503, 500, 200)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_URL", server.url)
+
+    assert provision() == {"status": 200}
+    assert server.requests == 3
+    assert delays == [0.2, 0.4]
+
+
+def test_client_errors_are_not_retried(stand_in, delays, monkeypatch):
+    server = stand_in(400)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_URL", server.url)
+
+    assert provision() == {"status": 400}
+    assert server.requests == 1
+    assert delays == []
+
+
+def test_retries_transport_errors_then_returns_502(delays, monkeypatch):
+    url = closed_port_url()
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_URL", url)
+
+    with pytest.raises(HTTPException) as error:
+        provision()
+
+    assert error.value.status_code == 502
+    assert delays == [0.2, 0.4, 0.8]
+
+
+def test_returns_502_when_the_last_attempt_fails(stand_in, delays, monkeypatch):
+    server = stand_in(500)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_URL", server.url)
+
+    with pytest.raises(HTTPException) as error:
+        provision()
+
+    assert error.value.status_code == 502
+    assert server.requests == 4
+    assert delays == [0.2, 0.4, 0.8]
+
+
+def test_cache_hit_skips_the_upstream_call(stand_in, delays, monkeypatch):
+    server = stand_in(200)
+    monkeypatch.setattr(chat_engine, "CHAT_ENGINE_URL", server.url)
+
+    assert provision() == {"status": 200}
+    assert provision() == {"status": 200}
+    assert server.requests == 1
+
+    provision("bob")
+    assert server.requests == 2
@@ -0,0 +1,60 @@
+# Concurrent likes against the app on a scratch database, the counter on the post has
+# to match the like rows exactly
+
+import asyncio
+
+import httpx
+from sqlalchemy import func, insert
+
+import main
+import models
+from database import engine, sessionLocal
+from models import User, Post, PostLike
+from routers import auth
+
+
+USERS = 1000
+
+
+def seed():
+    models.Base.metadata.create_all(bind=engine)
+
+    with sessionLocal() as db:
+        db.execute(insert(User), [{"username": f"liker{i}", "first_name": "b", "last_name": "b",
+                                   "hashed_password": ""} for i in range(USERS)])
+        users = db.query(User.id, User.username).filter(User.username.startswith("liker")).all()
+
+        post = Post(owner_id=users[0].id, content="viral")
+        db.add(post)
+        db.commit()
+
+        return post.id, [auth.create_access_token(user.username, user.id) for user in users]
+
+
+def like_all(post_id: int, tokens: list):
+    async def go():
+        async with main.lifespan(main.app), httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            async def like(token):
+                response = await client.post(f"/posts/{post_id}/like",
+                                             headers={"Authorization": f"Bearer {token}"})
+                return response.status_code
+
+            return await asyncio.gather(*[like(token) for token in tokens * 2])
+
+    return asyncio.run(go())
+
+
+def test_concurrent_likes_keep_the_counter_exact():
+    post_id, tokens = seed()
+
+    # Every user likes the post twice at once, the second like of each is rejected
+    codes = like_all(post_id, tokens)
+
+    with sessionLocal() as db:
+        likes = db.query(Post.likes).filter(Post.id == post_id).scalar()
+        rows = db.query(func.count(PostLike.id)).filter(PostLike.post == post_id).scalar()
+
+    assert codes.count(201) == USERS
+    assert codes.count(403) == USERS
+    assert likes == rows == USERS
@@ -0,0 +1,69 @@
+# Home feeds. Posts of authors below FEED_FANOUT_THRESHOLD followers are copied into
+# their followers' timeline_entries when written. Posts of bigger authors, and the
+# reader's own posts, are merged in when the feed is read instead of being copied
+# to every follower.
+
+from sqlalchemy import exists, insert, literal, select, union, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, Post, Follow, TimelineEntry
+
+import pagination
+
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+FEED_FANOUT_THRESHOLD = int(os.getenv("FEED_FANOUT_THRESHOLD", "10000"))
+# Recent posts copied into a timeline when following someone
+FEED_BACKFILL = int(os.getenv("FEED_BACKFILL", "100"))
+
+
+async def fan_out(db: AsyncSession, *post_ids: int):
+    # One INSERT ... SELECT over the authors' followers, a no-op for big authors
+    await db.execute(insert(TimelineEntry).from_select(
+        ["owner", "post", "created_at"],
+        select(Follow.follower, Post.id, Post.created_at).join(
+            Post, Post.owner_id == Follow.followee).join(User, User.id == Post.owner_id).filter(
+                Post.id.in_(post_ids), User.followers_count < FEED_FANOUT_THRESHOLD)))
+
+
+async def backfill(db: AsyncSession, follower: int, followee: int):
+    recent = select(literal(follower), Post.id, Post.created_at).join(
+        User, User.id == Post.owner_id).filter(
+            Post.owner_id == followee, User.followers_count < FEED_FANOUT_THRESHOLD,
+            ~exists().where(TimelineEntry.owner == follower, TimelineEntry.post == Post.id))
+
+    await db.execute(insert(TimelineEntry).from_select(
+        ["owner", "post", "created_at"],
+        pagination.seek(recent, Post, "", FEED_BACKFILL)))
+
+
+async def remove(db: AsyncSession, follower: int, followee: int):
+    await db.execute(delete(TimelineEntry).filter(
+        TimelineEntry.owner == follower,
+        TimelineEntry.post.in_(select(Post.id).filter(Post.owner_id == followee))))
+
+
+def feed(user_id: int, cursor: str, limit: int):
+    # Newest (id, created_at) of the reader's feed after `cursor`. Each source is
+    # seeked and limited on its own index before the two are merged.
+    materialized = select(TimelineEntry.post.label("id"), TimelineEntry.created_at).filter(
+        TimelineEntry.owner == user_id).subquery()
+
+    big_authors = select(Follow.followee).join(User, User.id == Follow.followee).filter(
+        Follow.follower == user_id, User.followers_count >= FEED_FANOUT_THRESHOLD)
+
+    pulled = select(Post.id, Post.created_at).filter(
+        (Post.owner_id == user_id) | Post.owner_id.in_(big_authors)).subquery()
+
+    pages = [pagination.seek(select(source.c.id, source.c.created_at), source.c, cursor,
+                             limit).subquery() for source in (materialized, pulled)]
+
+    # UNION drops posts found in both, e.g. fanned out before the author grew big
+    merged = union(*[select(page.c.id, page.c.created_at) for page in pages]).subquery()
+
+    return pagination.seek(select(merged.c.id, merged.c.created_at), merged.c, "", limit)
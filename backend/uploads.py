@@ -0,0 +1,186 @@
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from starlette import status
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import aiofiles
+import aiofiles.os
+
+from models import ImageBlob
+from storage import ContentAddressedStorage
+
+import asyncio
+import hashlib
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Multipart framing and form fields allowed around the file itself
+UPLOAD_MAX_REQUEST_BYTES = UPLOAD_MAX_BYTES + 64 * 1024
+
+# Formats accepted by Pillow's detection, mapped to the suffix of the stored name
+IMAGE_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+# Hex digits of the SHA-256 kept in blob names (160 bits), names have to fit the
+# 63 character image columns
+DIGEST_LENGTH = 40
+
+
+def too_large():
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f"Uploads are limited to {UPLOAD_MAX_BYTES} bytes")
+
+
+class UploadLimitMiddleware:
+    # Multipart bodies are parsed, and files spooled to disk, before the route runs.
+    # The limit is enforced on the raw request instead: up front on Content-Length,
+    # and while the body is read for requests sent without one.
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        headers = Headers(scope=scope) if scope["type"] == "http" else {}
+
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = headers.get("content-length", "")
+
+        if content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_BYTES:
+            error = too_large()
+            await JSONResponse({"detail": error.detail}, status_code=error.status_code)(
+                scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+
+                # Raised while the form is parsed, FastAPI passes HTTPExceptions through
+                if received > UPLOAD_MAX_REQUEST_BYTES:
+                    raise too_large()
+
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def blob_name(digest: str, format: str):
+    return f"{digest[:DIGEST_LENGTH]}{IMAGE_FORMATS[format]}"
+
+
+def detect_format(path: str):
+    # The stored suffix, and the type the file is served as, come from the content and
+    # never from the client's filename or content type
+    try:
+        with Image.open(path, formats=list(IMAGE_FORMATS)) as image:
+            image.verify()
+            return image.format
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Only JPEG, PNG, GIF and WebP images can be uploaded")
+
+
+async def discard(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def receive(upload: UploadFile, storage: ContentAddressedStorage):
+    # Streams the upload chunk by chunk into a temporary file inside the storage
+    # directory, hashing it on the way. Returns (tmp_path, sha256, size).
+    if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+        raise too_large()
+
+    tmp_path = storage.temp_path()
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, mode="wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+
+                if size > UPLOAD_MAX_BYTES:
+                    raise too_large()
+
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        await discard(tmp_path)
+        raise
+
+    return tmp_path, digest.hexdigest(), size
+
+
+async def acquire(db: AsyncSession, storage: ContentAddressedStorage, tmp_path: str,
+        name: str, size: int):
+    # Takes a reference on the blob and moves tmp_path into place if the blob is new.
+    # Must run at the start of a transaction, the blob row stays locked until the
+    # caller commits so a concurrent release cannot remove the file in between.
+    for attempt in range(2):
+        try:
+            taken = await db.execute(update(ImageBlob).filter(ImageBlob.name == name).values(
+                refcount=ImageBlob.refcount + 1).execution_options(synchronize_session=False))
+
+            if not taken.rowcount:
+                db.add(ImageBlob(name=name, size=size, refcount=1))
+                await db.flush()
+            break
+        except IntegrityError:
+            # Another upload of the same content inserted the row first
+            await db.rollback()
+            if attempt:
+                raise
+
+    path = storage.get_path(name)
+
+    if await aiofiles.os.path.exists(path):
+        await discard(tmp_path)
+    else:
+        await aiofiles.os.makedirs(storage.shard(name), exist_ok=True)
+        await aiofiles.os.replace(tmp_path, path)
+
+
+async def release(db: AsyncSession, storage: ContentAddressedStorage, name: str):
+    # Drops a reference on the blob, the last one removes its row and files.
+    # Files go before the commit, while the row is still locked.
+    await db.execute(update(ImageBlob).filter(ImageBlob.name == name).values(
+        refcount=ImageBlob.refcount - 1).execution_options(synchronize_session=False))
+
+    removed = await db.execute(delete(ImageBlob).filter(
+        ImageBlob.name == name, ImageBlob.refcount <= 0))
+
+    if removed.rowcount:
+        await asyncio.to_thread(storage.remove, name)
+
+
+async def save_upload(db: AsyncSession, upload: UploadFile, storage: ContentAddressedStorage):
+    tmp_path, digest, size = await receive(upload, storage)
+
+    try:
+        name = blob_name(digest, await asyncio.to_thread(detect_format, tmp_path))
+        await acquire(db, storage, tmp_path, name, size)
+    finally:
+        await discard(tmp_path)
+
+    return {"filename": name, "sha256": digest, "size": size}